@@ -0,0 +1,372 @@
+"""Offline benchmark of the daily birthday run
+
+Runs the real scheduler (`Tasks.task_main`) and `get_bdays` against fake
+guilds, an in-memory Config stand-in and a simulated clock, which skips
+every wait so a full day passes in seconds.
+
+Usage::
+
+    python -m Birthday.benchmark --guilds 10000 --birthdays 1000000
+"""
+
+from redbot.core import Config
+
+from collections import Counter
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+from unittest import mock
+
+import argparse
+import asyncio
+import copy
+import datetime
+import logging
+import random
+import shutil
+import tempfile
+import time
+
+from . import birthday as birthday_module
+from .birthday import Birthday
+from .stats import percentile
+
+TIMEZONES = [
+    "utc", "Europe/Berlin", "Europe/London", "America/New_York", "America/Los_Angeles",
+    "America/Sao_Paulo", "Asia/Kolkata", "Asia/Tokyo", "Australia/Sydney", "Pacific/Auckland",
+]
+
+
+class SimulatedClock:
+    """Clock which follows the real one, but skips ahead on every sleep
+
+    Processing time still counts, so lateness caused by slow guilds shows up.
+    Before skipping, `settle` is awaited, so work running next to the
+    scheduler (the dispatcher) finishes in real time."""
+
+    def __init__(self, start: float, duration: float, settle: Callable[[], Awaitable] = None):
+        self.offset = start - time.perf_counter()
+        self.end = start + duration
+        self.finished = asyncio.Event()
+        self.settle = settle
+
+    def time(self) -> float:
+        return time.perf_counter() + self.offset
+
+    def now(self, tz) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.time(), tz)
+
+    async def sleep(self, seconds: float):
+        if self.settle is not None:
+            await self.settle()
+        if seconds > 0:
+            self.offset += seconds
+        if self.time() >= self.end:
+            self.finished.set()
+            await asyncio.Future()  # parked until the benchmark cancels the task
+        await asyncio.sleep(0)
+
+
+class _Result:
+    """Value of a fake config call, usable with `await` and `async with`"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __await__(self):
+        yield from asyncio.sleep(0).__await__()
+        return copy.deepcopy(self.value)
+
+    async def __aenter__(self):
+        return self.value
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeValue:
+    def __init__(self, group: "FakeGroup", name: str):
+        self.group = group
+        self.name = name
+
+    def __call__(self):
+        self.group.config.calls[f"{self.group.scope.lower()}.{self.name}"] += 1
+        return _Result(self.group._data().get(self.name, self.group._defaults().get(self.name)))
+
+    async def set(self, value):
+        self.group.config.calls[f"{self.group.scope.lower()}.{self.name}.set"] += 1
+        self.group._data(create=True)[self.name] = value
+
+
+class FakeGroup:
+    def __init__(self, config: "FakeConfig", scope: str, keys: tuple):
+        self.config = config
+        self.scope = scope
+        self.keys = keys
+
+    def _defaults(self) -> dict:
+        return self.config.defaults.get(self.scope, {})
+
+    def _data(self, create: bool = False) -> dict:
+        data = self.config.data.setdefault(self.scope, {})
+        for key in self.keys:
+            if key not in data:
+                if not create:
+                    return {}
+                data[key] = {}
+            data = data[key]
+        return data
+
+    def __getattr__(self, name: str) -> FakeValue:
+        return FakeValue(self, name)
+
+    def all(self):
+        self.config.calls[f"{self.scope.lower()}.all"] += 1
+        if len(self.keys) < self.config.depth[self.scope]:
+            # base group, handed out as is like Red does
+            return _Result(self._data(create=True))
+        return _Result({**self._defaults(), **self._data()})
+
+    async def clear(self):
+        self.config.calls[f"{self.scope.lower()}.clear"] += 1
+        *parents, leaf = self.keys
+        FakeGroup(self.config, self.scope, tuple(parents))._data().pop(leaf, None)
+
+
+class FakeConfig:
+    """In-memory stand-in for the parts of `Config` the cog uses
+
+    Counts every call in `calls`."""
+
+    GLOBAL, GUILD, USER, MEMBER = Config.GLOBAL, Config.GUILD, Config.USER, Config.MEMBER
+
+    def __init__(self):
+        self.data: Dict[str, dict] = {}
+        self.defaults: Dict[str, dict] = {}
+        self.depth = {self.GLOBAL: 0, self.GUILD: 1, self.USER: 1, self.MEMBER: 2}
+        self.calls: Counter = Counter()
+
+    def register_global(self, **defaults):
+        self.defaults[self.GLOBAL] = defaults
+
+    def register_guild(self, **defaults):
+        self.defaults[self.GUILD] = defaults
+
+    def register_user(self, **defaults):
+        self.defaults[self.USER] = defaults
+
+    def register_member(self, **defaults):
+        self.defaults[self.MEMBER] = defaults
+
+    def __getattr__(self, name: str) -> FakeValue:
+        return FakeValue(FakeGroup(self, self.GLOBAL, ()), name)
+
+    def _get_base_group(self, scope: str, *keys) -> FakeGroup:
+        return FakeGroup(self, scope, tuple(str(k) for k in keys))
+
+    def guild(self, guild) -> FakeGroup:
+        return FakeGroup(self, self.GUILD, (str(guild.id),))
+
+    def user(self, user) -> FakeGroup:
+        return FakeGroup(self, self.USER, (str(user.id),))
+
+    def user_from_id(self, user_id: int) -> FakeGroup:
+        return FakeGroup(self, self.USER, (str(user_id),))
+
+    def member(self, member) -> FakeGroup:
+        return self.member_from_ids(member.guild.id, member.id)
+
+    def member_from_ids(self, guild_id: int, member_id: int) -> FakeGroup:
+        return FakeGroup(self, self.MEMBER, (str(guild_id), str(member_id)))
+
+    def _all(self, scope: str, data: dict) -> dict:
+        defaults = self.defaults.get(scope, {})
+        return {int(key): {**defaults, **value} for key, value in data.items()}
+
+    async def all_guilds(self) -> dict:
+        self.calls["all_guilds"] += 1
+        return self._all(self.GUILD, self.data.get(self.GUILD, {}))
+
+    async def all_users(self) -> dict:
+        self.calls["all_users"] += 1
+        return self._all(self.USER, self.data.get(self.USER, {}))
+
+    async def all_members(self, guild=None) -> dict:
+        self.calls["all_members"] += 1
+        members = self.data.get(self.MEMBER, {})
+        if guild is not None:
+            return self._all(self.MEMBER, members.get(str(guild.id), {}))
+        return {int(guild_id): self._all(self.MEMBER, data) for guild_id, data in members.items()}
+
+
+class FakeMember:
+    def __init__(self, member_id: int, guild: "FakeGuild"):
+        self.id = member_id
+        self.guild = guild
+        self.name = f"user{member_id}"
+        self.mention = f"<@{member_id}>"
+        self.roles: list = []
+
+    def __str__(self):
+        return f"{self.name}#0001"
+
+    def __hash__(self):
+        return hash(self.id)
+
+    async def add_roles(self, role, reason=None):
+        self.guild.api_calls += 1
+        self.roles.append(role)
+        role.members.append(self)
+
+    async def remove_roles(self, role, reason=None):
+        self.guild.api_calls += 1
+        self.roles.remove(role)
+        role.members.remove(self)
+
+
+class FakeRole:
+    def __init__(self, role_id: int):
+        self.id = role_id
+        self.members: List[FakeMember] = []
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, guild: "FakeGuild"):
+        self.id = channel_id
+        self.guild = guild
+
+    async def send(self, content=None, embed=None):
+        self.guild.api_calls += 1
+        self.guild.messages += 1
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, with_role: bool):
+        self.id = guild_id
+        self.name = f"guild{guild_id}"
+        self._members: Dict[int, FakeMember] = {}
+        self.channel = FakeChannel(guild_id + 1, self)
+        self.role: Optional[FakeRole] = FakeRole(guild_id + 2) if with_role else None
+        self.api_calls = 0
+        self.messages = 0
+
+    @property
+    def members(self) -> List[FakeMember]:
+        return list(self._members.values())
+
+    def get_member(self, member_id: int) -> Optional[FakeMember]:
+        return self._members.get(member_id)
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self.channel if channel_id == self.channel.id else None
+
+    def get_role(self, role_id: int) -> Optional[FakeRole]:
+        return self.role if self.role and role_id == self.role.id else None
+
+
+class FakeBot:
+    def __init__(self, guilds: List[FakeGuild]):
+        self.guilds = guilds
+        self._guilds = {guild.id: guild for guild in guilds}
+        self.loop = asyncio.get_running_loop()
+
+    async def wait_until_red_ready(self):
+        return
+
+    def get_guild(self, guild_id: int) -> Optional[FakeGuild]:
+        return self._guilds.get(guild_id)
+
+
+def populate(config: FakeConfig, guild_count: int, birthday_count: int, with_role: bool, seed: int) -> List[FakeGuild]:
+    rng = random.Random(seed)
+    guilds = [FakeGuild((i + 1) << 22, with_role) for i in range(guild_count)]
+
+    guild_conf = config.data.setdefault(config.GUILD, {})
+    for guild in guilds:
+        guild_conf[str(guild.id)] = {
+            "timezone": rng.choice(TIMEZONES),
+            "channel": guild.channel.id,
+            "role": guild.role.id if guild.role else None,
+        }
+
+    user_conf = config.data.setdefault(config.USER, {})
+    for i in range(birthday_count):
+        user_id = (guild_count + i + 1) << 22
+        guild = guilds[rng.randrange(guild_count)]
+        guild._members[user_id] = FakeMember(user_id, guild)
+
+        day, month = rng.randint(1, 28), rng.randint(1, 12)
+        year = rng.choice((None, rng.randint(1950, 2015)))
+        user_conf[str(user_id)] = {"birthday": f"{day:02d}-{month:02d}-{year}" if year else f"{day:02d}-{month:02d}"}
+
+    return guilds
+
+
+async def run(guild_count: int, birthday_count: int, with_role: bool, seed: int, days: float, dispatch_rate: float):
+    config = FakeConfig()
+    data_path = Path(tempfile.mkdtemp(prefix="birthday-benchmark-"))
+    with mock.patch.object(Config, "get_conf", return_value=config), \
+            mock.patch.object(birthday_module, "cog_data_path", return_value=data_path):
+        # registers the defaults on the fake config
+        probe = FakeBot([])
+        cog = Birthday(probe)
+        cog.stop()
+        cog.write_queue_task.cancel()
+
+    setup_start = time.perf_counter()
+    guilds = populate(config, guild_count, birthday_count, with_role, seed)
+    config.data.setdefault(config.GLOBAL, {})["dispatch_rate"] = dispatch_rate
+    setup = time.perf_counter() - setup_start
+
+    cog.bot = FakeBot(guilds)
+    async def settle():
+        while cog.finishing:
+            await asyncio.wait(set(cog.finishing))
+
+    cog.clock = clock = SimulatedClock(time.time(), days * 86400, settle)
+    config.calls.clear()
+
+    get_bdays_start = time.perf_counter()
+    await cog.get_bdays(guilds[0])
+    get_bdays = time.perf_counter() - get_bdays_start
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    cog.start()
+    await clock.finished.wait()
+    await cog.shutdown()
+    cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+    shutil.rmtree(data_path, ignore_errors=True)
+
+    runs = list(cog.scheduler_stats.runs)
+    durations = [run.duration for run in runs]
+    lateness = [run.lateness for run in runs]
+
+    print(f"Guilds: {guild_count}, birthdays: {birthday_count}, simulated days: {days} (setup {setup:.1f}s)")
+    print(f"Single get_bdays:   {get_bdays * 1000:.1f}ms")
+    print(f"Wall time:          {wall:.2f}s")
+    print(f"CPU time:           {cpu:.2f}s")
+    print(f"Guild runs:         {len(runs)} ({sum(run.birthdays for run in runs)} birthdays, "
+          f"{sum(guild.api_calls for guild in guilds)} API calls, {sum(guild.messages for guild in guilds)} messages)")
+    print(f"Per-guild latency:  p50 {percentile(durations, 50) * 1000:.2f}ms, "
+          f"p99 {percentile(durations, 99) * 1000:.2f}ms, max {max(durations, default=0) * 1000:.2f}ms")
+    print(f"Lateness:           p50 {percentile(lateness, 50) * 1000:.2f}ms, p99 {percentile(lateness, 99) * 1000:.2f}ms")
+    print("Config calls:")
+    for name, count in config.calls.most_common():
+        print(f"  {name:<28}{count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--guilds", type=int, default=200)
+    parser.add_argument("--birthdays", type=int, default=20000)
+    parser.add_argument("--days", type=float, default=1.0, help="simulated days")
+    parser.add_argument("--roles", action="store_true", help="configure a birthday role in every guild")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dispatch-rate", type=float, default=1000.0, help="API calls per real second")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(args.guilds, args.birthdays, args.roles, args.seed, args.days, args.dispatch_rate))
+
+
+if __name__ == "__main__":
+    main()
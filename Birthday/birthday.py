@@ -1,4 +1,5 @@
 from redbot.core import commands, Config
+from redbot.core.data_manager import cog_data_path
 from redbot.core.utils import AsyncIter
 from redbot.core.utils.chat_formatting import bold, pagify
 from redbot.core.utils.menus import menu, DEFAULT_CONTROLS
@@ -10,11 +11,22 @@ import datetime
 import logging
 import pytz
 import asyncio
-import operator
 import json
-from typing import Union
+import csv
+import io
+import time
+from collections import defaultdict
+from typing import Dict, Optional, Set, Union
 
 from .birthday_task import Tasks
+from .store import SCHEMA_VERSION, BirthdayStore, date_from_day, day_of_year, decode_bday, encode_bday, format_bday, parse_bday
+from .templates import compile_template, template_for
+from .write_queue import WriteBehindQueue
+
+# invalid import rows listed in chat, the rest are attached as a file
+IMPORT_ERRORS_SHOWN = 20
+# users converted per config write by migrate_birthdays
+MIGRATION_BATCH = 5000
 
 class MenuSource(menus.ListPageSource):
     def __init__(self, data, name: str):
@@ -41,7 +53,16 @@ class Birthday(commands.Cog, Tasks):
         self.bot = bot
         self.config = Config.get_conf(self, identifier=365911945565569036)
         self.logger = logging.getLogger(("red.benno1237.birthdays"))
+        Tasks.__init__(self)
+        self.lease_path = cog_data_path(self) / "leases"
         
+        default_global = {
+            "schema_version": 0,
+            "dispatch_rate": 10.0,
+            "dispatch_window": 60.0,
+            "leases": False
+        }
+
         default_guild = {
             "birthday_enabled": True,
             "timezone": "utc",
@@ -61,111 +82,412 @@ class Birthday(commands.Cog, Tasks):
             "birthday_message": None
         }
 
+        self.config.register_global(**default_global)
         self.config.register_guild(**default_guild)
         self.config.register_user(**default_user)
         self.config.register_member(**self.default_member)
 
+        # user id -> ids of guilds which may hold member data for that user
+        self._member_index: Optional[Dict[int, Set[int]]] = None
+        self._member_index_lock = asyncio.Lock()
+
+        # guild id -> birthdays of its members, see get_bday_index
+        self._bday_index: Dict[int, BirthdayStore] = {}
+
+        self.write_queue = WriteBehindQueue(self.config)
+        self.write_queue_task = self.bot.loop.create_task(self.write_queue.run())
+
         self.start()
 
+    async def cog_before_invoke(self, ctx):
+        # commands read from config directly, queued writes have to be visible
+        if self.write_queue.depth:
+            await self.write_queue.flush()
+
+    async def cog_after_invoke(self, ctx):
+        # any command might have changed settings of a prepared announcement
+        if ctx.guild:
+            self.invalidate_announcement(ctx.guild.id)
+
+    def cog_unload(self):
+        # Red 3.4 doesn't await cog_unload, so the shutdown runs as a task of its own
+        if self.main_task:
+            self.main_task.cancel()
+        self.bot.loop.create_task(self.unload())
+
+    async def unload(self):
+        await self.shutdown()
+        await self.write_queue.close()
+
+    async def migrate_birthdays(self):
+        """Converts birthdays stored as strings into integers
+
+        Streams over all users in batches of `MIGRATION_BATCH`, one config
+        write per batch. A batch is written while holding the write queue's
+        lock and without yielding, so queued or concurrent writes are never
+        overwritten. Every converted value is read back from config (shadow
+        read) and has to match the original string, otherwise the string is
+        restored. Readers accept both formats, so the cog works while this
+        is running."""
+        if await self.config.schema_version() >= SCHEMA_VERSION:
+            return
+
+        start = time.perf_counter()
+        converted = kept = 0
+
+        strings = [
+            (str(user_id), data["birthday"]) for user_id, data in (await self.config.all_users()).items()
+            if isinstance(data.get("birthday"), str)
+        ]
+        for i in range(0, len(strings), MIGRATION_BATCH):
+            batch = {}
+            for user_id, bday in strings[i:i + MIGRATION_BATCH]:
+                try:
+                    expected = parse_bday(bday)
+                    encoded = encode_bday(*expected)
+                except (ValueError, IndexError):
+                    self.logger.warning("Keeping unparsable birthday %r", bday)
+                    kept += 1
+                    continue
+                batch[user_id] = (bday, expected, encoded)
+
+            async with self.write_queue.lock:
+                async with self.config._get_base_group(self.config.USER).all() as users:
+                    for user_id, (bday, _, encoded) in list(batch.items()):
+                        data = users.get(user_id)
+                        if data is None or data.get("birthday") != bday:
+                            # changed since it was read, newer values are integers already
+                            del batch[user_id]
+                            continue
+                        data["birthday"] = encoded
+
+                # shadow read
+                failed = {}
+                for user_id, (bday, expected, _) in batch.items():
+                    stored = await self.config.user_from_id(int(user_id)).birthday()
+                    if decode_bday(stored) != expected or parse_bday(format_bday(stored)) != expected:
+                        self.logger.warning("Shadow read of birthday %r returned %r, keeping the string", bday, stored)
+                        failed[user_id] = bday
+
+                if failed:
+                    async with self.config._get_base_group(self.config.USER).all() as users:
+                        for user_id, bday in failed.items():
+                            users.setdefault(user_id, {})["birthday"] = bday
+
+            converted += len(batch) - len(failed)
+            kept += len(failed)
+            await asyncio.sleep(0)
+
+        await self.config.schema_version.set(SCHEMA_VERSION)
+        self.invalidate_bdays()
+        self.logger.info(
+            "Migrated %d birthdays to schema %d in %.2fs, kept %d",
+            converted, SCHEMA_VERSION, time.perf_counter() - start, kept
+        )
+
     def check(self, m, ctx, content: str):
         return m.content.lower() == content and m.author == ctx.author
 
+    async def get_member_index(self) -> Dict[int, Set[int]]:
+        """Reverse index of user id -> guild ids holding member data
+
+        Built once from a single `all_members()` read and kept
+        up to date by every command writing member data."""
+        if self._member_index is None:
+            async with self._member_index_lock:
+                if self._member_index is None:
+                    index = defaultdict(set)
+                    for guild_id, members in (await self.config.all_members()).items():
+                        for user_id in members:
+                            index[int(user_id)].add(int(guild_id))
+                    self._member_index = index
+
+        return self._member_index
+
+    async def index_member(self, member: discord.Member):
+        index = await self.get_member_index()
+        index[member.id].add(member.guild.id)
+
+    def invalidate_bdays(self, guild_id: int = None):
+        """Drops the cached birthday index of a guild, or of all guilds"""
+        if guild_id is None:
+            self._bday_index.clear()
+        else:
+            self._bday_index.pop(guild_id, None)
+        self.invalidate_announcement(guild_id)
+
+    async def get_bday_index(self, guild: discord.Guild) -> BirthdayStore:
+        """Cached `get_bdays`, rebuilt after birthdays or members changed"""
+        store = self._bday_index.get(guild.id)
+        if store is None:
+            generation = self._generation(guild.id)
+            store = await self.get_bdays(guild)
+            # birthdays or members changed while building, the next call rebuilds it
+            if generation == self._generation(guild.id):
+                self._bday_index[guild.id] = store
+
+        return store
+
+    async def get_upcoming(self, guild: discord.Guild, start: datetime.date, window: int):
+        """Birthdays in the `window` days starting at `start`
+
+        Returns `(member, date, age)` tuples ordered by date, `age` is None
+        if no year is set. The range is looked up by bisection on the
+        cached guild index, wrapping around the end of the year."""
+        store = await self.get_bday_index(guild)
+        if not store or window < 1:
+            return []
+
+        first = day_of_year(start.day, start.month)
+        end = start + datetime.timedelta(days=window - 1)
+        last = day_of_year(end.day, end.month)
+
+        if window >= 366:
+            ranges = [store.between(first, 366), store.between(1, first - 1)]
+        elif last >= first and end.year == start.year:
+            ranges = [store.between(first, last)]
+        else:
+            ranges = [store.between(first, 366), store.between(1, last)]
+
+        upcoming = []
+        for indices in ranges:
+            for i in indices:
+                member = guild.get_member(store.user_ids[i])
+                if member is None:
+                    continue
+
+                day, month = date_from_day(store.days[i])
+                year = start.year if (month, day) >= (start.month, start.day) else start.year + 1
+                try:
+                    date = datetime.date(year, month, day)
+                except ValueError:  # 29-02 outside of leap years
+                    date = datetime.date(year, 2, 28)
+
+                upcoming.append((member, date, year - store.years[i] if store.years[i] else None))
+
+        return upcoming
+
     async def clear_data_for_user(self, user: Union[discord.User, discord.Member], guild: discord.Guild = None, clear_user: bool = True):
+        index = await self.get_member_index()
+
+        # only guilds the user's birthday or member data shows up in
+        guild_ids = set(index.get(user.id, ()))
+        if guild is not None:
+            guild_ids.add(guild.id)
         if clear_user:
-            await self.config.user(user).clear()
+            self.write_queue.clear_user(user.id)
+            guild_ids.update(other.id for other in user.mutual_guilds)
+        for guild_id in guild_ids:
+            self.invalidate_bdays(guild_id)
 
         if guild == None:
-            async for guild in AsyncIter(self.bot.guilds):
-                if user not in guild.users:
-                    await self.config.member_from_ids(guild.id, user.id).clear()
+            # member data of guilds the user is still part of is kept
+            for guild_id in list(index.get(user.id, ())):
+                other = self.bot.get_guild(guild_id)
+                if other is not None and other.get_member(user.id) is None:
+                    self.write_queue.clear_member(guild_id, user.id)
+                    self.unindex_member(user.id, guild_id)
         else:
-            await self.config.member_from_ids(guild.id, user.id).clear()
+            self.write_queue.clear_member(guild.id, user.id)
+            self.unindex_member(user.id, guild.id)
 
-    async def sort_bdays(self, bdays: list, mode: bool, guild: discord.Guild):
-        passed = []
-        upcoming = []
+    def unindex_member(self, user_id: int, guild_id: int):
+        index = self._member_index
+        if index is not None and user_id in index:
+            index[user_id].discard(guild_id)
+            if not index[user_id]:
+                del index[user_id]
+
+    async def sort_bdays(self, bdays: BirthdayStore, mode: bool, guild: discord.Guild):
+        """`(index, age on the next birthday)` pairs in list order
 
+        mode: upcoming birthdays first if set, otherwise starting from the beginning of the year"""
         now = datetime.datetime.now(pytz.timezone(await self.config.guild(guild).timezone()))
 
-        for bday in bdays:
-            if ((int(bday[1]) >= now.day) and (int(bday[2]) == now.month)) or (int(bday[2]) > now.month):
-                upcoming.append(bday)
-            else:
-                try:
-                    passed.append((bday[0], bday[1], bday[2], str(int(bday[3]) + 1)))
-                except IndexError:
-                    passed.append(bday)
+        return bdays.ordered(day_of_year(now.day, now.month), mode, now.year)
 
-        upcoming.sort(key=operator.itemgetter(2, 1))
-        passed.sort(key=operator.itemgetter(2, 1))
+    async def get_bdays(self, guild, member_data: dict = None) -> BirthdayStore:
+        """Birthdays of all members of a guild
 
-        if mode: # Starting from the beginning of the year
-            bdays = upcoming + passed
+        `member_data` can be passed in if the caller already fetched it."""
+        if self.write_queue.depth:
+            await self.write_queue.flush()
+
+        if member_data is None:
+            member_data = await self.config.all_members(guild)
+
+        users = await self.config.all_users()
+        if len(guild.members) < len(users):
+            candidates = ((member.id, users.get(member.id)) for member in guild.members)
         else:
-            bdays = passed + upcoming
-        
-        return bdays
-
-    async def get_bdays(self, guild):
-        bdays = []
-        async for user, data in AsyncIter((await self.config.all_users()).items()):
-            user = guild.get_member(user)
-            if user != None:
-                if await self.config.member_from_ids(user, guild.id).birthday_enabled():
-                    if len(data["birthday"].split("-")) == 3:
-                        d, m, y = data["birthday"].split("-")
-                        current_year = datetime.datetime.now(pytz.timezone(await self.config.guild(guild).timezone())).year
-                        age = current_year - int(y)
-                        bdays.append((user, d, m, age))
-                    else:
-                        d, m = data["birthday"].split("-")
-                        bdays.append((user, d, m))
-        
-        return bdays
+            candidates = ((user_id, data) for user_id, data in users.items() if guild.get_member(user_id) is not None)
 
-    async def bday_to_datetime(self, bday: str, channel: discord.TextChannel):
+        items = []
+        async for user_id, data in AsyncIter(candidates, steps=1000):
+            if data and data.get("birthday"):
+                if member_data.get(user_id, {}).get("birthday_enabled", True):
+                    try:
+                        day, year = decode_bday(data["birthday"])
+                    except (ValueError, IndexError):
+                        continue
+                    items.append((user_id, day, year))
+
+        return BirthdayStore(items)
+
+    @staticmethod
+    def validate_bday(bday: str) -> bool:
+        """Checks a `DD-MM-YYYY` or `DD-MM` birthday string"""
         if len(bday.split("-")) == 2:
-            split_string = "%d-%m"
+            # leap year, so 29-02 is accepted without a year
+            bday, split_string = f"{bday}-2000", "%d-%m-%Y"
         else:
             split_string = "%d-%m-%Y"
 
         try:
-            datetime_obj = datetime.datetime.strptime(bday, split_string)
+            datetime.datetime.strptime(bday, split_string)
             return True
         except ValueError:
-            await channel.send("Invalid format!")
             return False
 
+    async def bday_to_datetime(self, bday: str, channel: discord.TextChannel):
+        if self.validate_bday(bday):
+            return True
+
+        await channel.send("Invalid format!")
+        return False
+
+    def parse_import_rows(self, filename: str, content: str):
+        """Yields `(row, user_id, birthday)` tuples from a CSV or JSON export"""
+        if filename.lower().endswith(".json"):
+            data = json.loads(content)
+            if isinstance(data, dict):
+                data = [{"user_id": k, "birthday": v} for k, v in data.items()]
+            for row, entry in enumerate(data, start=1):
+                if isinstance(entry, dict):
+                    yield row, entry.get("user_id"), entry.get("birthday")
+                else:
+                    yield row, None, None
+        else:
+            for row, entry in enumerate(csv.reader(io.StringIO(content)), start=1):
+                if not entry or (row == 1 and entry[0].strip().lower() == "user_id"):
+                    continue
+                if len(entry) < 2:
+                    yield row, None, None
+                else:
+                    yield row, entry[0].strip(), entry[1].strip()
+
+    async def import_bdays(self, guild: discord.Guild, filename: str, content: str, overwrite: bool = False):
+        """Validates an import file and stores all valid rows in a single config write
+
+        Returns the number of imported rows, a list of `(row, reason)` errors
+        and the number of processed rows."""
+        users = {}
+        errors = []
+        processed = 0
+
+        for row, user_id, bday in self.parse_import_rows(filename, content):
+            processed += 1
+            if user_id is None or bday is None:
+                errors.append((row, "expected `user_id` and `birthday`"))
+                continue
+            try:
+                user_id = int(user_id)
+            except (TypeError, ValueError):
+                errors.append((row, f"invalid user id `{user_id}`"))
+                continue
+            if guild.get_member(user_id) is None:
+                errors.append((row, f"`{user_id}` is not a member of this server"))
+                continue
+            if not isinstance(bday, str) or not self.validate_bday(bday):
+                errors.append((row, f"invalid birthday `{bday}`"))
+                continue
+            users[str(user_id)] = encode_bday(*parse_bday(bday))
+
+            if processed % 1000 == 0:
+                await asyncio.sleep(0)
+
+        imported = []
+        if users:
+            async with self.write_queue.lock, self.config._get_base_group(self.config.USER).all() as user_conf:
+                for user_id, bday in users.items():
+                    data = user_conf.setdefault(user_id, {})
+                    if not overwrite and data.get("birthday") is not None:
+                        continue
+                    data["birthday"] = bday
+                    imported.append(int(user_id))
+
+            guild_ids = set()
+            for user_id in imported:
+                user = self.bot.get_user(user_id)
+                if user is not None:
+                    guild_ids.update(guild.id for guild in user.mutual_guilds)
+            for guild_id in guild_ids:
+                self.invalidate_bdays(guild_id)
+
+        return len(imported), errors, processed
+
+    def invalidate_user(self, user: Union[discord.User, discord.Member]):
+        """Drops the cached birthday index of every guild showing `user`'s birthday"""
+        for guild in user.mutual_guilds:
+            self.invalidate_bdays(guild.id)
+
     async def set_bday_for_user(self, bday, user):
-        await self.config.user(user).birthday.set(bday)
+        self.write_queue.set_user(user.id, birthday=encode_bday(*parse_bday(bday)))
+        self.invalidate_user(user)
 
     async def remove_bday_for_user(self, user):
-        await self.config.user(user).clear()
+        self.write_queue.clear_user(user.id)
+        self.invalidate_user(user)
+
+    def render_birthday_message(self, member: discord.Member, age: Optional[int], msg: Optional[str], now: datetime.datetime, strict: bool = False):
+        """Renders a single birthday message without any config access
+
+        Invalid custom messages fall back to the default one unless `strict` is set."""
+        tags = {"name": member.name, "full_name": str(member), "mention": member.mention, "age": age, "guild": member.guild.name, "date": now.date()}
+
+        try:
+            return template_for(msg, age).render(tags)
+        except ValueError:
+            if strict:
+                raise
+            return template_for(None, age).render(tags)
+
+    def render_birthday_messages(self, bdays: list, member_data: dict, now: datetime.datetime):
+        """Renders the messages for all given `(member, age)` pairs in one pass
+
+        `member_data` is a snapshot of `Config.all_members(guild)`."""
+        return [
+            self.render_birthday_message(
+                member,
+                age,
+                member_data.get(member.id, {}).get("birthday_message"),
+                now
+            )
+            for member, age in bdays
+        ]
 
     async def get_custom_message(self, user: Union[discord.User, discord.Member], msg: str = None, check: bool = False):
-        now = datetime.datetime.now(pytz.timezone(await self.config.guild(user.guild).timezone()))
-        bday = (await self.config.user(user).birthday()).split("-")
+        """Formats the birthday message of a single member
+
+        With `check` set, returns `"length"` if the message is too long or
+        `"age"` if it uses `{age}` without a birthday year set and raises
+        `TemplateError` for invalid messages."""
+        guild_data = await self.config.guild(user.guild).all()
+        now = datetime.datetime.now(pytz.timezone(guild_data["timezone"]))
+        _, year = decode_bday(await self.config.user(user).birthday())
         if not msg:
             msg = await self.config.member(user).birthday_message()
         elif isinstance(user, discord.Member):
-            if len(msg) > await self.config.guild(user.guild).custom_message_length():
+            if len(msg) > guild_data["custom_message_length"]:
                 return "length"
 
-        try:
-            age = now.year - int(bday[2])
-            if not msg:
-                msg = "{mention} is getting {age} years old today! :partying_face:"
-        except ValueError:
-            if not msg:
-                msg = "It's {mention}'s birthday today! :partying_face:"
-            age = None
-            if check:
-                return "age"
+        age = now.year - year if year else None
 
-        _allowed_tags = {"name": user.name, "full_name": str(user), "mention": user.mention, "age": age, "guild": user.guild.name, "date": now.date()}
+        if check and msg:
+            if age is None and "age" in compile_template(msg).fields:
+                return "age"
 
-        msg = msg.format(name=_allowed_tags["name"], full_name=_allowed_tags["full_name"], mention=_allowed_tags["mention"], guild=_allowed_tags["guild"], date=_allowed_tags["date"], age=_allowed_tags["age"])
-        return msg    
+        return self.render_birthday_message(user, age, msg, now, strict=check)
 
     @commands.group(name="bday", aliases=["birthday"])
     async def bday(self, ctx):
@@ -227,7 +549,9 @@ class Birthday(commands.Cog, Tasks):
     async def bday_toggle(self, ctx):
         """Toggles the authors birthday reminder"""
         current = await self.config.member(ctx.author).birthday_enabled()
-        await self.config.member(ctx.author).birthday_enabled.set(not current)
+        self.write_queue.set_member(ctx.guild.id, ctx.author.id, birthday_enabled=not current)
+        await self.index_member(ctx.author)
+        self.invalidate_bdays(ctx.guild.id)
         await ctx.send(f"{ctx.author.mention}'s birthday reminders are now set to: `{not current}`")
 
     @commands.admin_or_permissions(administrator=True)
@@ -255,7 +579,8 @@ class Birthday(commands.Cog, Tasks):
     async def bday_custommsg_reset(self, ctx):
         """Resets your custom message to the default one"""
 
-        await self.config.member(ctx.author).birthday_message.set(None)
+        self.write_queue.set_member(ctx.guild.id, ctx.author.id, birthday_message=None)
+        await self.index_member(ctx.author)
         await ctx.tick()
 
     @commands.guild_only()
@@ -346,7 +671,12 @@ class Birthday(commands.Cog, Tasks):
                     "Wohoo it's {mention}'s birthday today, the {date}."
                 )
                 msg = await self.bot.wait_for("message", check=lambda message: message.author == ctx.author, timeout=60.0)
-                formatted = await self.get_custom_message(ctx.author, msg=msg.content, check=True)
+                try:
+                    formatted = await self.get_custom_message(ctx.author, msg=msg.content, check=True)
+                except ValueError as e:
+                    await ctx.send(f":x: Invalid message: {e}")
+                    return
+
                 if formatted == "age":
                     await ctx.send("Parameter `age` cannot be used without a birthday year set.")
                 elif formatted == "length":
@@ -358,10 +688,8 @@ class Birthday(commands.Cog, Tasks):
                     
                     await self.bot.wait_for("message", check=lambda message: message.author == ctx.author, timeout=30)
 
-                    try:
-                        await self.config.member(ctx.author).birthday_message.set(msg.content)
-                    except TypeError:
-                        await ctx.send("Message is not json serializable. Maybe you used unsupported emotes?")
+                    self.write_queue.set_member(ctx.guild.id, ctx.author.id, birthday_message=msg.content)
+                    await self.index_member(ctx.author)
             except asyncio.TimeoutError:
                 try:
                     await maybe_delete.delete()
@@ -385,7 +713,7 @@ class Birthday(commands.Cog, Tasks):
                 await self.set_bday_for_user(bday, ctx.author)
                 await ctx.send(f"Your birthday is now set to: `{bday}`")
         else:
-            current = await self.config.user(ctx.author).birthday()
+            current = format_bday(await self.config.user(ctx.author).birthday())
             maybe_delete = await ctx.send(f"Your birthday is already set! Would you like to overwrite it?\nType 'Yes' to confirm.\nCurrent birthday: `{current}`")
             try:
                 await self.bot.wait_for("message", check=lambda message: self.check(m=message, ctx=ctx, content="yes"), timeout=30.0)
@@ -409,6 +737,170 @@ class Birthday(commands.Cog, Tasks):
         else:
             await ctx.send("No birthday set.")
 
+    @commands.admin_or_permissions(administrator=True)
+    @commands.guild_only()
+    @bday.command(name="import")
+    async def bday_import(self, ctx, overwrite: bool = False):
+        """Imports birthdays from an attached CSV or JSON file
+
+        CSV: one `user_id,birthday` row per member
+        JSON: a list of `{"user_id": ..., "birthday": ...}` objects
+        or a `{user_id: birthday}` mapping
+
+        Birthdays use the same format as `[p]bday set`.
+        `overwrite` replaces birthdays which are already set."""
+
+        if not ctx.message.attachments:
+            await ctx.send(":x: Attach a `.csv` or `.json` file to import.")
+            return
+
+        attachment = ctx.message.attachments[0]
+        async with ctx.typing():
+            start = time.perf_counter()
+            try:
+                content = (await attachment.read()).decode("utf-8-sig")
+                imported, errors, processed = await self.import_bdays(ctx.guild, attachment.filename, content, overwrite)
+            except (UnicodeDecodeError, json.JSONDecodeError, csv.Error, TypeError) as e:
+                await ctx.send(f":x: Unable to read `{attachment.filename}`: {e}")
+                return
+            elapsed = time.perf_counter() - start
+
+        msg = (
+            f"Imported `{imported}` of `{processed}` rows "
+            f"({processed / elapsed if elapsed else processed:.0f} rows/s)."
+        )
+        file = None
+        if errors:
+            lines = [f"Row {row}: {reason}" for row, reason in errors]
+            msg += f"\n{len(errors)} rows were skipped:\n" + "\n".join(lines[:IMPORT_ERRORS_SHOWN])
+            if len(errors) > IMPORT_ERRORS_SHOWN:
+                msg += f"\n... and {len(errors) - IMPORT_ERRORS_SHOWN} more, see the attached file."
+                file = discord.File(io.BytesIO("\n".join(lines).encode("utf-8")), filename="import-errors.txt")
+
+        await ctx.send(msg[:2000], file=file)
+
+    @commands.admin_or_permissions(administrator=True)
+    @commands.guild_only()
+    @bday.command(name="export")
+    async def bday_export(self, ctx, file_format: str = "csv"):
+        """Exports this server's birthdays
+
+        `file_format` can be `csv` or `json`"""
+
+        file_format = file_format.lower()
+        if file_format not in ("csv", "json"):
+            await ctx.send(":x: Format has to be either `csv` or `json`.")
+            return
+
+        start = time.perf_counter()
+        rows = []
+        async for user_id, data in AsyncIter((await self.config.all_users()).items(), steps=1000):
+            if data.get("birthday") and ctx.guild.get_member(user_id) is not None:
+                rows.append((user_id, format_bday(data["birthday"])))
+
+        if file_format == "json":
+            content = json.dumps([{"user_id": user_id, "birthday": bday} for user_id, bday in rows], indent=4)
+        else:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(("user_id", "birthday"))
+            writer.writerows(rows)
+            content = buffer.getvalue()
+        elapsed = time.perf_counter() - start
+
+        file = discord.File(io.BytesIO(content.encode("utf-8")), filename=f"birthdays-{ctx.guild.id}.{file_format}")
+        await ctx.send(
+            f"Exported `{len(rows)}` birthdays ({len(rows) / elapsed if elapsed else len(rows):.0f} rows/s).",
+            file=file
+        )
+
+    @commands.is_owner()
+    @bday.command(name="writequeue")
+    async def bday_writequeue(self, ctx):
+        """Shows statistics of the buffered config writes"""
+
+        stats = self.write_queue.stats()
+        await ctx.send(
+            "```\n"
+            f"Queue depth:        {stats['depth']}\n"
+            f"Queued writes:      {stats['queued']} ({stats['coalesced']} coalesced)\n"
+            f"Flushes:            {stats['flushes']} ({stats['flushed_keys']} keys)\n"
+            f"Flush latency:      last {stats['last_flush_latency'] * 1000:.1f}ms, "
+            f"avg {stats['avg_flush_latency'] * 1000:.1f}ms, max {stats['max_flush_latency'] * 1000:.1f}ms\n"
+            "```"
+        )
+
+    @commands.is_owner()
+    @bday.command(name="dispatch")
+    async def bday_dispatch(self, ctx, rate: float = None, window: float = None):
+        """Global pacing of birthday messages and role changes
+
+        `rate`: API calls per second for all guilds together
+        `window`: max seconds an announcement may be delayed to smooth out bursts
+
+        Shows the current settings if no arguments are given."""
+
+        if rate is not None:
+            if rate <= 0 or (window is not None and window < 0):
+                await ctx.send(":x: `rate` has to be positive and `window` can't be negative.")
+                return
+
+            await self.config.dispatch_rate.set(rate)
+            self.dispatcher.rate = rate
+            if window is not None:
+                await self.config.dispatch_window.set(window)
+                self.dispatcher.window = window
+
+        await ctx.send(
+            f"Rate: `{self.dispatcher.rate}` calls/s, lateness window: `{self.dispatcher.window}`s\n"
+            f"Queued: `{self.dispatcher.backlog}`, sent: `{self.dispatcher.dispatched}`, failed: `{self.dispatcher.failed}`"
+        )
+
+    @commands.is_owner()
+    @bday.command(name="leases")
+    async def bday_leases(self, ctx, status: bool = None):
+        """Claim every guild's announcement in a file shared by all processes of this bot
+
+        Needed if several processes may announce the same guilds. Always on
+        if this process only runs some of the shards.
+
+        Shows the current setting if no argument is given."""
+
+        if status is not None:
+            await self.config.leases.set(status)
+            self.use_lease(status)
+
+        await ctx.send(f"Leases are {'on' if self.lease else 'off'}.")
+
+    @commands.is_owner()
+    @bday.command(name="schedstats")
+    async def bday_schedstats(self, ctx, slowest: int = 5):
+        """Shows how punctual the daily birthday announcements are
+
+        Lateness is the delay between a guild's scheduled midnight and
+        the start of its announcement."""
+
+        stats = self.scheduler_stats.summary()
+        if not stats["runs"]:
+            await ctx.send("No announcements were sent since the cog was loaded.")
+            return
+
+        msg = (
+            f"Runs:       {stats['runs']} ({stats['birthdays']} birthdays, {stats['api_calls']} API calls)\n"
+            f"Lateness:   p50 {stats['lateness_p50'] * 1000:.0f}ms, p99 {stats['lateness_p99'] * 1000:.0f}ms\n"
+            f"Duration:   p50 {stats['duration_p50'] * 1000:.0f}ms, p99 {stats['duration_p99'] * 1000:.0f}ms\n"
+            "\nSlowest guilds (finished after schedule):\n"
+        )
+        for run in self.scheduler_stats.slowest(slowest):
+            guild = self.bot.get_guild(run.guild_id)
+            msg += (
+                f"{guild.name if guild else run.guild_id}: {(run.finished - run.scheduled) * 1000:.0f}ms "
+                f"({run.birthdays} birthdays, {run.api_calls} API calls)\n"
+            )
+
+        for page in pagify(msg, page_length=1900):
+            await ctx.send(f"```\n{page}\n```")
+
     @commands.guild_only()
     @bday.command(name="list")
     async def bday_list(self, ctx, mode: bool = None):
@@ -417,25 +909,29 @@ class Birthday(commands.Cog, Tasks):
         if mode == None:
             mode = await self.config.guild(ctx.guild).upcoming_first()
 
-        bdays = await self.get_bdays(ctx.guild)
-
+        bdays = await self.get_bday_index(ctx.guild)
 
-        if bdays != []:
-            bdays = await self.sort_bdays(bdays, mode, ctx.guild)
+        if bdays:
+            ordered = await self.sort_bdays(bdays, mode, ctx.guild)
 
             msg = ""
             previous_month = None
 
-            async for bday in AsyncIter(bdays):
-                month = datetime.datetime(year=1, month=int(bday[2]), day=1).strftime("%B")
+            async for i, age in AsyncIter(ordered, steps=100):
+                member = ctx.guild.get_member(bdays.user_ids[i])
+                if member is None:
+                    continue
+
+                day, month = date_from_day(bdays.days[i])
+                month = datetime.datetime(year=1, month=month, day=1).strftime("%B")
                 if month != previous_month:
                     msg += f"\n{bold(month)}\n"
                     previous_month = month
 
-                try:
-                    msg += f"{bday[1]}: {bold(str(bday[0]))} - {bold(str(bday[3]))} years\n"
-                except IndexError:
-                    msg += f"{bday[1]}: {bold(str(bday[0]))}\n"
+                if age is not None:
+                    msg += f"{day:02d}: {bold(str(member))} - {bold(str(age))} years\n"
+                else:
+                    msg += f"{day:02d}: {bold(str(member))}\n"
 
             pages = list(pagify(msg, delims=["\n\n"], page_length=1000))
 
@@ -446,7 +942,33 @@ class Birthday(commands.Cog, Tasks):
             await ctx.send("No birthdays set on this server.")
 
     @commands.guild_only()
-    @bday.group(name="cleardata", invoke_without_subcommand=True)
+    @bday.command(name="upcoming")
+    async def bday_upcoming(self, ctx, days: int = 7):
+        """Lists the birthdays in the next few days
+
+        `days`: how many days to look ahead, including today"""
+
+        days = max(1, min(days, 366))
+        today = datetime.datetime.now(pytz.timezone(await self.config.guild(ctx.guild).timezone())).date()
+        upcoming = await self.get_upcoming(ctx.guild, today, days)
+
+        if not upcoming:
+            await ctx.send(f"No birthdays in the next {days} days.")
+            return
+
+        msg = ""
+        for member, date, age in upcoming:
+            if age is not None:
+                msg += f"{date.strftime('%d %B')}: {bold(str(member))} - {bold(str(age))} years\n"
+            else:
+                msg += f"{date.strftime('%d %B')}: {bold(str(member))}\n"
+
+        pages = list(pagify(msg, page_length=1000))
+        pages = menus.MenuPages(source=MenuSource(pages, f"Birthdays in the next {days} days"), clear_reactions_after=True)
+        await pages.start(ctx)
+
+    @commands.guild_only()
+    @bday.group(name="cleardata", invoke_without_command=True)
     async def bday_cleardata(self, ctx, all_guilds: bool = False, clear_user: bool = False):
         """Clears guild specific data for the current guild
 
@@ -457,7 +979,7 @@ class Birthday(commands.Cog, Tasks):
         try:
             await self.bot.wait_for("message", check=lambda message: self.check(m=message, ctx=ctx, content="yes"), timeout=30.0)
 
-            if self.all_guilds:
+            if all_guilds:
                 guild = None
             else:
                 guild = ctx.guild
@@ -476,7 +998,7 @@ class Birthday(commands.Cog, Tasks):
         `all_guilds` clears guild specific data for all guilds
         `clear_user` clears global user data"""
 
-        if self.all_guilds:
+        if all_guilds:
             guild = None
         else:
             guild = ctx.guild
@@ -511,6 +1033,10 @@ class Birthday(commands.Cog, Tasks):
         except asyncio.TimeoutError:
             await msg.delete()       
 
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        self.invalidate_bdays(member.guild.id)
+
     @commands.Cog.listener()
     async def on_member_remove(self, member: discord.Member):
         await self.clear_data_for_user(user=member, guild=member.guild, clear_user=True)
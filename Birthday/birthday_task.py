@@ -2,135 +2,446 @@ from redbot.core import commands
 from redbot.core.utils import AsyncIter
 from redbot.core.utils.chat_formatting import pagify
 
-from typing import Optional
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from pathlib import Path
 
 import contextlib
+import functools
 import discord
 import datetime
 import pytz
 import asyncio
+import time
+
+from .dispatch import MESSAGE, ROLE, Dispatcher
+from .lease import DailyLease
+from .stats import SchedulerStats
+from .store import day_of_year
+
+
+class Clock:
+    """Time source of the scheduler
+
+    Replaced by a simulated clock in the benchmark."""
+
+    def time(self) -> float:
+        return time.time()
+
+    def now(self, tz: datetime.tzinfo) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.time(), tz)
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+
+class Announcement(NamedTuple):
+    """Everything needed to announce a guild's birthdays, apart from the API calls"""
+    channel_id: Optional[int]
+    role_id: Optional[int]
+    member_ids: Tuple[int, ...]
+    embeds: List[discord.Embed]
 
 
 def done_callback(task):
-    if task.done():
+    if task.done() and not task.cancelled():
         task.result()
 
 
 class Tasks:
+    # announcements are prepared this many seconds before a guild's midnight
+    prepare_ahead: float = 600
+    # queued announcement calls get this many seconds to go out when the cog unloads
+    drain_timeout: float = 30
+    # due guilds claimed per lease call, the first ones are announced before the rest is claimed
+    claim_batch: int = 50
+
     def __init__(self):
-        self.time_for_guild_loops: dict = {}
+        self.time_for_guild_loops: Dict[int, float] = {}
         self.reset: asyncio.Event = asyncio.Event()
-        self.task_main: Optional[asyncio.Task] = None
+        self.main_task: Optional[asyncio.Task] = None
+        self.dispatcher = Dispatcher()
+        self.dispatcher_task: Optional[asyncio.Task] = None
+        # runs waiting for the dispatcher to send their calls, see finish_run
+        self.finishing: Set[asyncio.Task] = set()
+        self.scheduler_stats = SchedulerStats()
+        self.clock = Clock()
+        # only used if other processes may announce the same guilds, see use_lease
+        self.lease: Optional[DailyLease] = None
+        self.lease_path: Optional[Path] = None
+        self.next_lease_cleanup = 0.0
+        # guild id -> (fire time, retry time) of claims left unfinished by another process
+        self.takeovers: Dict[int, Tuple[float, float]] = {}
+
+        # guild id -> (fire time, generation, announcement), see prepare_announcements
+        self.prepared: Dict[int, Tuple[float, tuple, Optional[Announcement]]] = {}
+        # guild id -> fire time whose preparation failed, it is prepared again when announcing
+        self.prepare_failed: Dict[int, float] = {}
+        self._generations: Dict[Optional[int], int] = {}
 
     def start(self):
         if self.is_running():
             self.stop()
-               
-        self.task_main: asyncio.Task = self.bot.loop.create_task(self.task_main())
-        self.task_main.add_done_callback(done_callback)
+
+        self.main_task = self.bot.loop.create_task(self.task_main())
+        self.main_task.add_done_callback(done_callback)
+        self.dispatcher_task = self.bot.loop.create_task(self.dispatcher.run())
+        self.dispatcher_task.add_done_callback(done_callback)
 
     def stop(self):
-        with contextlib.suppress(asyncio.CancelledError):
-            self.task_main.cancel()
+        if self.main_task:
+            self.main_task.cancel()
+        if self.dispatcher_task:
+            self.dispatcher_task.cancel()
+
+    async def shutdown(self):
+        """Stops scheduling and gives the queued announcement calls `drain_timeout` seconds to go out
+
+        Claims of guilds whose calls were dropped stay unfinished and are
+        retried on the next start."""
+        if self.main_task:
+            self.main_task.cancel()
+
+        if self.dispatcher_task and not self.dispatcher_task.done():
+            try:
+                await asyncio.wait_for(self.dispatcher.drain(), self.drain_timeout)
+            except asyncio.TimeoutError:
+                self.logger.warning("Dropped %d queued birthday announcement calls", self.dispatcher.backlog)
+
+        if self.finishing:
+            await asyncio.wait(self.finishing, timeout=self.drain_timeout)
+        for task in self.finishing:
+            task.cancel()
+        self.stop()
 
     def is_running(self):
-        if not self.task_main:
-            return False
+        return self.main_task is not None and not self.main_task.done()
+
+    def owns_guild(self, guild: discord.Guild) -> bool:
+        """Whether `guild` is on a shard run by this process"""
+        shard_ids = getattr(self.bot, "shard_ids", None)
+        if shard_ids is None:
+            return True
+
+        return (guild.id >> 22) % (self.bot.shard_count or 1) in shard_ids
 
-        if isinstance(self.task_main, asyncio.Task):
-            return not self.task_main.cancelled()
+    def use_lease(self, enabled: bool):
+        """Turns the per guild claims on or off
+
+        They are always on if this process only runs some of the shards."""
+        if enabled or getattr(self.bot, "shard_ids", None) is not None:
+            if self.lease is None:
+                self.lease = DailyLease(self.lease_path)
+        else:
+            self.lease = None
+
+    async def cleanup_leases(self, now: float):
+        """Removes old claims, at most once a day"""
+        if self.lease and now >= self.next_lease_cleanup:
+            self.next_lease_cleanup = now + 86400
+            await self.lease.cleanup()
+
+    @staticmethod
+    def next_fire_time(timezone: str, now: float) -> float:
+        """UTC timestamp of the next local midnight in `timezone`"""
+        tz = pytz.timezone(timezone)
+        local_now = datetime.datetime.fromtimestamp(now, tz)
+        midnight = datetime.datetime.combine(local_now.date() + datetime.timedelta(days=1), datetime.time(hour=0))
+
+        return tz.localize(midnight).timestamp()
 
     async def initialize_guild_loops(self):
-        self.time_for_guild_loops = {}
-        async for guild in AsyncIter(self.bot.guilds):
-            await self.update_time_for_guild(guild)
+        """Schedules all guilds from a single `all_guilds()` read
 
-    async def update_time_for_guild(self, guild: discord.Guild, timestamp=None):
-        timezone = await self.config.guild(guild).timezone()
-        now = datetime.datetime.now(pytz.timezone(timezone))
+        Fire times are computed once per distinct timezone."""
+        start = time.perf_counter()
+
+        all_guilds = await self.config.all_guilds()
+        now = self.clock.time()
+        fire_times: Dict[str, float] = {}
 
-        utc_time_for_guild_loop: datetime.datetime = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(hour=0)) - now.utcoffset()
+        await self.cleanup_leases(now)
+
+        self.time_for_guild_loops = {}
+        for guild in self.bot.guilds:
+            if not self.owns_guild(guild):
+                continue
+            timezone = all_guilds.get(guild.id, {}).get("timezone", "utc")
+            if timezone not in fire_times:
+                fire_times[timezone] = self.next_fire_time(timezone, now)
+            self.time_for_guild_loops[guild.id] = fire_times[timezone]
 
-        self.time_for_guild_loops[guild.id] = utc_time_for_guild_loop.timestamp() if not timestamp else timestamp
+        if self.lease:
+            await self.recover_claims(now)
 
-    async def wait_task(self, time: float):
-        await asyncio.sleep(
-            time - datetime.datetime.utcnow().timestamp()
+        self.logger.info(
+            "Scheduled %d guilds across %d timezones in %.3fs",
+            len(self.time_for_guild_loops), len(fire_times), time.perf_counter() - start
         )
 
+    async def recover_claims(self, now: float):
+        """Schedules the unfinished claims of this process's guilds from the last day
+
+        A process which died while announcing leaves its claims behind. They
+        are retried once they expired, unless another process completed them."""
+        self.takeovers = {}
+        for guild_id, fire_time, expires in await self.lease.unfinished(now - 86400):
+            if guild_id in self.time_for_guild_loops and fire_time <= now:
+                self.takeovers[guild_id] = (fire_time, max(now, expires))
+
+        if self.takeovers:
+            self.logger.info("Retrying %d unfinished birthday announcements", len(self.takeovers))
+
+    async def update_time_for_guild(self, guild: discord.Guild, timestamp=None):
+        if not timestamp:
+            timezone = await self.config.guild(guild).timezone()
+            timestamp = self.next_fire_time(timezone, self.clock.time())
+
+        self.time_for_guild_loops[guild.id] = timestamp
+
+    async def wait_task(self, timestamp: float):
+        await self.clock.sleep(max(0, timestamp - self.clock.time()))
+
     async def task_main(self):
-        try:
-            await self.bot.wait_until_red_ready()
-            await self.initialize_guild_loops()
-            while True:
-                next_loop = sorted(list(self.time_for_guild_loops.items()), key=lambda i: i[1])[0]
-
-                guild = self.bot.get_guild(next_loop[0])
-
-                wait = asyncio.create_task(self.wait_task(next_loop[1]))
-
-                await asyncio.wait(
-                    [
-                        self.reset.wait(),
-                        wait
-                    ],
-                    return_when=asyncio.FIRST_COMPLETED,
-                )
-                if self.reset.is_set():
-                    wait.cancel()
-                    with contextlib.suppress(asyncio.CancelledError):
-                        await wait
-                        self.reset.clear()
+        await self.migrate_birthdays()
+        await self.bot.wait_until_red_ready()
+        self.dispatcher.rate = await self.config.dispatch_rate()
+        self.dispatcher.window = await self.config.dispatch_window()
+        self.use_lease(await self.config.leases())
+        await self.initialize_guild_loops()
+        while True:
+            self.reset.clear()
+            if not self.time_for_guild_loops:
+                await self.reset.wait()
+                continue
+
+            next_loop = min(self.time_for_guild_loops.values())
+            next_prepare = min(
+                (
+                    timestamp - self.prepare_ahead for guild_id, timestamp in self.time_for_guild_loops.items()
+                    if not self.is_prepared(guild_id, timestamp) and self.prepare_failed.get(guild_id) != timestamp
+                ),
+                default=next_loop
+            )
+            next_takeover = min((retry for _, retry in self.takeovers.values()), default=next_loop)
+
+            wait = asyncio.create_task(self.wait_task(min(next_loop, next_prepare, next_takeover)))
+            reset = asyncio.create_task(self.reset.wait())
+
+            await asyncio.wait([reset, wait], return_when=asyncio.FIRST_COMPLETED)
+            for task in (wait, reset):
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
 
+            if self.reset.is_set():
+                # schedule changed while waiting
+                continue
+
+            now = self.clock.time()
+            due = [guild_id for guild_id, timestamp in self.time_for_guild_loops.items() if timestamp <= now]
+            takeovers = [guild_id for guild_id, (_, retry) in self.takeovers.items() if retry <= now]
+
+            if not due and not takeovers:
+                await self.prepare_announcements()
+                continue
+
+            runs = []
+            for guild_id in due:
+                guild = self.bot.get_guild(guild_id)
+                if guild is None:
+                    self.time_for_guild_loops.pop(guild_id, None)
+                    continue
+
+                runs.append((guild_id, self.time_for_guild_loops[guild_id]))
                 await self.update_time_for_guild(guild)
 
-                guild_data = await self.config.guild(guild).all()
-                channel = guild.get_channel(guild_data["channel"])
-                role = guild.get_role(guild_data["role"])
+            runs += [(guild_id, self.takeovers.pop(guild_id)[0]) for guild_id in takeovers]
+
+            for i in range(0, len(runs), self.claim_batch):
+                await self.announce_runs(runs[i:i + self.claim_batch])
+
+            await self.cleanup_leases(self.clock.time())
+
+    async def announce_runs(self, runs: List[Tuple[int, float]]):
+        """Announces `(guild id, fire time)` runs which this process could claim"""
+        # another process of this bot may already be on it
+        if self.lease:
+            claimed = set(await self.lease.claim(runs, self.clock.time()))
+            for guild_id, scheduled in runs:
+                if (guild_id, scheduled) not in claimed:
+                    self.logger.debug("Announcement for guild %s is claimed by another process", guild_id)
+            runs = [run for run in runs if run in claimed]
+
+        for guild_id, scheduled in runs:
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
+
+            started = self.clock.time()
+            try:
+                birthdays, api_calls = await self.announce_birthdays(guild, scheduled)
+            except Exception:
+                self.logger.exception("Unable to announce birthdays in guild %s", guild_id)
+                birthdays, api_calls = 0, 0
+
+            task = asyncio.create_task(self.finish_run(guild_id, scheduled, started, birthdays, api_calls))
+            self.finishing.add(task)
+            task.add_done_callback(self.finishing.discard)
+
+    async def finish_run(self, guild_id: int, scheduled: float, started: float, birthdays: int, api_calls: int):
+        """Completes the claim of a guild's run once the dispatcher sent all of its calls"""
+        await self.dispatcher.join(guild_id)
+        if self.lease:
+            await self.lease.complete(guild_id, scheduled)
+
+        self.scheduler_stats.record(guild_id, scheduled, started, self.clock.time(), birthdays, api_calls)
+
+    def invalidate_announcement(self, guild_id: int = None):
+        """Discards the prepared announcement of a guild, or of all guilds"""
+        self._generations[guild_id] = self._generations.get(guild_id, 0) + 1
+        if guild_id is None:
+            self.prepared.clear()
+        else:
+            self.prepared.pop(guild_id, None)
+
+    def _generation(self, guild_id: int) -> tuple:
+        return self._generations.get(None, 0), self._generations.get(guild_id, 0)
+
+    def is_prepared(self, guild_id: int, fire_time: float) -> bool:
+        prepared = self.prepared.get(guild_id)
+        return prepared is not None and prepared[0] == fire_time and prepared[1] == self._generation(guild_id)
+
+    async def prepare_announcements(self):
+        """Prepares the announcements of all guilds firing within `prepare_ahead` seconds
+
+        Yields between guilds and stops as soon as any guild is due."""
+        for guild_id, fire_time in list(self.time_for_guild_loops.items()):
+            now = self.clock.time()
+            if min(self.time_for_guild_loops.values(), default=now) <= now:
+                return
+            if fire_time - self.prepare_ahead > now or self.is_prepared(guild_id, fire_time):
+                continue
+            if self.prepare_failed.get(guild_id) == fire_time:
+                continue
+
+            guild = self.bot.get_guild(guild_id)
+            generation = self._generation(guild_id)
+            if guild is None:
+                self.prepared[guild_id] = (fire_time, generation, None)
+                continue
+
+            try:
+                announcement = await self.prepare_announcement(guild, fire_time)
+            except Exception:
+                self.logger.exception("Unable to prepare birthday announcement for guild %s", guild_id)
+                self.prepare_failed[guild_id] = fire_time
+                continue
+
+            # settings or birthdays changed while preparing
+            if generation == self._generation(guild_id):
+                self.prepared[guild_id] = (fire_time, generation, announcement)
 
-                if channel:
-                    bdays = await self.get_bdays(guild)
+            await asyncio.sleep(0)
 
-                    msg = ""
-                    async for bday in AsyncIter(bdays):
-                        now = datetime.datetime.now(pytz.timezone(guild_data["timezone"]))
-                        month = now.month
-                        day = now.day
+    async def prepare_announcement(self, guild: discord.Guild, fire_time: float) -> Optional[Announcement]:
+        """Fetches birthdays and renders the messages for the day starting at `fire_time`
 
-                        if (int(bday[1]) == int(day)) and (int(bday[2]) == int(month)):
-                            bday_msg = await self.get_custom_message(bday[0])
-                            msg += bday_msg + "\n\n"
+        Returns None if there is nothing to announce."""
+        guild_data = await self.config.guild(guild).all()
+        if not guild_data["birthday_enabled"] or not guild.get_channel(guild_data["channel"]):
+            return None
 
-                            if role:
-                                async for member in AsyncIter(role.members):
-                                    member: discord.Member
-                                    await member.remove_roles(role, reason="Birthday is over")
+        member_data = await self.config.all_members(guild)
+        bdays = await self.get_bday_index(guild)
 
-                                async for bday in AsyncIter(bdays):
-                                    if isinstance(bday[0], discord.Member):
-                                        await bday[0].add_roles(role, reason="Birthday")
+        now = datetime.datetime.fromtimestamp(fire_time, pytz.timezone(guild_data["timezone"]))
+        todays = []
+        for i in bdays.on_day(day_of_year(now.day, now.month)):
+            member = guild.get_member(bdays.user_ids[i])
+            if member is not None:
+                todays.append((member, bdays.age(i, now.year)))
 
-                    if msg != "":
-                        pages = list(pagify(msg, delims=["\n\n"], page_length=1000))
-                        for page in pages:
-                            embed = discord.Embed(color=discord.Color.blue(), description=page)
-                            await channel.send(embed=embed)
+        msg = "".join(bday_msg + "\n\n" for bday_msg in self.render_birthday_messages(todays, member_data, now))
+        embeds = [
+            discord.Embed(color=discord.Color.blue(), description=page)
+            for page in pagify(msg, delims=["\n\n"], page_length=1000)
+        ]
 
-        except asyncio.CancelledError:
-            raise
+        return Announcement(guild_data["channel"], guild_data["role"], tuple(member.id for member, _ in todays), embeds)
+
+    async def send_announcement(self, guild: discord.Guild, announcement: Announcement) -> int:
+        """Hands a prepared announcement to the dispatcher
+
+        Returns the number of queued API calls."""
+        api_calls = 0
+        channel = guild.get_channel(announcement.channel_id)
+        role = guild.get_role(announcement.role_id) if announcement.role_id else None
+
+        if not channel:
+            return 0
+
+        delay = self.dispatcher.jitter()
+
+        for embed in announcement.embeds:
+            self.dispatcher.submit(guild.id, MESSAGE, functools.partial(channel.send, embed=embed), delay)
+            api_calls += 1
+
+        if role:
+            todays_members = {guild.get_member(member_id) for member_id in announcement.member_ids}
+            todays_members.discard(None)
+            async for member in AsyncIter(role.members, steps=100):
+                member: discord.Member
+                if member not in todays_members:
+                    self.dispatcher.submit(guild.id, ROLE, functools.partial(member.remove_roles, role, reason="Birthday is over"), delay)
+                    api_calls += 1
+
+            for member in todays_members:
+                if role not in member.roles:
+                    self.dispatcher.submit(guild.id, ROLE, functools.partial(member.add_roles, role, reason="Birthday"), delay)
+                    api_calls += 1
+
+        return api_calls
+
+    async def announce_birthdays(self, guild: discord.Guild, fire_time: float = None):
+        """Sends today's birthday messages and updates the birthday role
+
+        Uses the prepared announcement if it is still valid.
+        Returns the number of birthdays and discord API calls."""
+        if fire_time is None:
+            fire_time = self.clock.time()
+
+        self.prepare_failed.pop(guild.id, None)
+        if self.is_prepared(guild.id, fire_time):
+            announcement = self.prepared.pop(guild.id)[2]
+        else:
+            self.prepared.pop(guild.id, None)
+            announcement = await self.prepare_announcement(guild, fire_time)
+
+        if announcement is None:
+            return 0, 0
+
+        return len(announcement.member_ids), await self.send_announcement(guild, announcement)
 
     @commands.Cog.listener()
     async def on_guild_join(self, guild: discord.Guild):
+        if not self.owns_guild(guild):
+            return
+
         await self.update_time_for_guild(guild)
         if not self.reset.is_set():
             self.reset.set()
 
+    @commands.Cog.listener()
+    async def on_guild_available(self, guild: discord.Guild):
+        # guilds which weren't available during startup
+        if self.is_running() and guild.id not in self.time_for_guild_loops and self.owns_guild(guild):
+            await self.update_time_for_guild(guild)
+            self.reset.set()
+
     @commands.Cog.listener()
     async def on_guild_remove(self, guild: discord.Guild):
         if guild.id in self.time_for_guild_loops.keys():
             del self.time_for_guild_loops[guild.id]
             if not self.reset.is_set():
                 self.reset.set()
-
-    def cog_unload(self):
-        self.stop()
@@ -0,0 +1,148 @@
+from collections import Counter, defaultdict, deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Set, Tuple
+
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import random
+
+log = logging.getLogger("red.benno1237.birthdays.dispatch")
+
+MESSAGE = 0
+ROLE = 1
+
+
+class Dispatcher:
+    """Paces all announcement API calls against one global budget
+
+    Calls are started at most `rate` per second (token bucket with
+    `burst` tokens). When many guilds fire at once, each guild's calls are
+    delayed by a random offset of up to `window` seconds, scaled by the
+    current backlog, so the burst is spread out instead of hitting global
+    rate limits. Among calls which are ready, channel messages go before
+    role changes. Calls sharing a key (the guild) run one at a time, in
+    submission order within a priority."""
+
+    def __init__(self, rate: float = 10.0, window: float = 60.0, burst: int = 5):
+        self.rate = rate
+        self.window = window
+        self.burst = burst
+
+        self._delayed: List[Tuple[float, int, int, Hashable, Callable[[], Awaitable]]] = []
+        self._ready: List[Tuple[int, int, Hashable, Callable[[], Awaitable]]] = []
+        # calls waiting for the running call of their key
+        self._blocked: Dict[Hashable, Deque[Tuple[int, int, Hashable, Callable[[], Awaitable]]]] = defaultdict(deque)
+        self._busy: Set[Hashable] = set()
+        self._pending: Counter = Counter()
+        self._key_idle: Dict[Hashable, asyncio.Event] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._running: Set[asyncio.Task] = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+        self._tokens = float(burst)
+        self._refilled: Optional[float] = None
+
+        self.dispatched = 0
+        self.failed = 0
+
+    @property
+    def backlog(self) -> int:
+        return len(self._delayed) + len(self._ready) + sum(len(blocked) for blocked in self._blocked.values())
+
+    def jitter(self) -> float:
+        """Random delay for the next guild, 0 unless there is a backlog"""
+        return random.uniform(0, min(self.window, self.backlog / self.rate))
+
+    def submit(self, key: Hashable, priority: int, call: Callable[[], Awaitable], delay: float = 0.0):
+        """Queues `call` to be started no earlier than `delay` seconds from now"""
+        loop = asyncio.get_running_loop()
+        heapq.heappush(self._delayed, (loop.time() + delay, priority, next(self._seq), key, call))
+        self._pending[key] += 1
+        self._key_idle.setdefault(key, asyncio.Event())
+        self._idle.clear()
+        self._wakeup.set()
+
+    async def join(self, key: Hashable = None):
+        """Waits until all queued calls, or those of `key`, finished"""
+        if key is None:
+            await self._idle.wait()
+        elif key in self._key_idle:
+            await self._key_idle[key].wait()
+
+    async def drain(self):
+        """Drops the remaining delays and waits until all queued calls finished"""
+        while self._delayed:
+            _, priority, seq, key, call = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, (priority, seq, key, call))
+        self._wakeup.set()
+        await self.join()
+
+    def _take_token(self, now: float) -> float:
+        """Takes a token, returns how long to wait if there is none"""
+        if self._refilled is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    async def _call(self, call: Callable[[], Awaitable]):
+        try:
+            await call()
+            self.dispatched += 1
+        except Exception:
+            self.failed += 1
+            log.exception("Birthday announcement call failed")
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        self._running.discard(task)
+        self._busy.discard(key)
+        for entry in self._blocked.pop(key, ()):
+            heapq.heappush(self._ready, entry)
+        self._wakeup.set()
+
+        self._pending[key] -= 1
+        if not self._pending[key]:
+            del self._pending[key]
+            self._key_idle.pop(key).set()
+        if not self._running and not self.backlog:
+            self._idle.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, priority, seq, key, call = heapq.heappop(self._delayed)
+                heapq.heappush(self._ready, (priority, seq, key, call))
+
+            # the key of a running call is skipped until that call finished
+            while self._ready and self._ready[0][2] in self._busy:
+                entry = heapq.heappop(self._ready)
+                self._blocked[entry[2]].append(entry)
+
+            if not self._ready:
+                self._wakeup.clear()
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            wait = self._take_token(now)
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+
+            _, _, key, call = heapq.heappop(self._ready)
+            self._busy.add(key)
+            task = asyncio.create_task(self._call(call))
+            self._running.add(task)
+            task.add_done_callback(functools.partial(self._done, key))
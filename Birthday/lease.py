@@ -0,0 +1,135 @@
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextlib.contextmanager
+def _locked(path: Path):
+    """Opens `path` for reading and writing with an exclusive lock held"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        yield fd
+    finally:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.close(fd)
+
+
+def _read(fd: int) -> Optional[dict]:
+    os.lseek(fd, 0, os.SEEK_SET)
+    raw = b""
+    while True:
+        chunk = os.read(fd, 4096)
+        if not chunk:
+            break
+        raw += chunk
+
+    try:
+        return json.loads(raw) if raw else None
+    except ValueError:
+        return None
+
+
+def _write(fd: int, data: dict):
+    os.lseek(fd, 0, os.SEEK_SET)
+    os.ftruncate(fd, 0)
+    os.write(fd, json.dumps(data).encode())
+    os.fsync(fd)
+
+
+class DailyLease:
+    """Per guild and day claims shared by all processes of a bot
+
+    Every process running the cog tries to claim a guild's announcement
+    before sending it. Only one claim per guild and fire time succeeds. A
+    claim which isn't completed within `ttl` seconds, e.g. because its
+    process died, can be taken over by another process. Processes pick up
+    such claims of their guilds when they start, see `unfinished`.
+
+    The file I/O runs in the default executor."""
+
+    def __init__(self, path: Path, owner: str = None, ttl: float = 600):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.ttl = ttl
+
+    def _file(self, guild_id: int, fire_time: float) -> Path:
+        return self.path / f"{guild_id}-{int(fire_time)}.lease"
+
+    def _claim(self, guild_id: int, fire_time: float, now: float) -> bool:
+        with _locked(self._file(guild_id, fire_time)) as fd:
+            current = _read(fd)
+            if current:
+                if current["done"]:
+                    return False
+                if current["owner"] != self.owner and current["expires"] > now:
+                    return False
+
+            _write(fd, {"owner": self.owner, "expires": now + self.ttl, "done": False})
+            return True
+
+    def _claim_many(self, claims: List[Tuple[int, float]], now: float) -> List[Tuple[int, float]]:
+        return [(guild_id, fire_time) for guild_id, fire_time in claims if self._claim(guild_id, fire_time, now)]
+
+    def _complete(self, guild_id: int, fire_time: float):
+        with _locked(self._file(guild_id, fire_time)) as fd:
+            current = _read(fd)
+            if current is None or current["owner"] == self.owner:
+                _write(fd, {"owner": self.owner, "expires": 0, "done": True})
+
+    def _unfinished(self, since: float) -> List[Tuple[int, float, float]]:
+        claims = []
+        for file in self.path.glob("*.lease"):
+            with contextlib.suppress(OSError, ValueError):
+                guild_id, fire_time = map(int, file.stem.split("-"))
+                if fire_time < since:
+                    continue
+                with _locked(file) as fd:
+                    current = _read(fd)
+                if current and not current["done"]:
+                    claims.append((guild_id, float(fire_time), current["expires"]))
+        return claims
+
+    def _cleanup(self, cutoff: float):
+        for file in self.path.glob("*.lease"):
+            with contextlib.suppress(OSError):
+                if file.stat().st_mtime < cutoff:
+                    file.unlink()
+
+    async def claim(self, claims: Iterable[Tuple[int, float]], now: float = None) -> List[Tuple[int, float]]:
+        """Claims the announcements of `(guild id, fire time)` pairs in a single executor call
+
+        Returns the claimed pairs, the others are held or completed by another process."""
+        now = time.time() if now is None else now
+        return await asyncio.get_running_loop().run_in_executor(None, self._claim_many, list(claims), now)
+
+    async def complete(self, guild_id: int, fire_time: float):
+        await asyncio.get_running_loop().run_in_executor(None, self._complete, guild_id, fire_time)
+
+    async def unfinished(self, since: float) -> List[Tuple[int, float, float]]:
+        """`(guild id, fire time, expires)` of claims since `since` which were never completed"""
+        return await asyncio.get_running_loop().run_in_executor(None, self._unfinished, since)
+
+    async def cleanup(self, max_age: float = 3 * 86400):
+        """Removes claims older than `max_age` seconds"""
+        await asyncio.get_running_loop().run_in_executor(None, self._cleanup, time.time() - max_age)
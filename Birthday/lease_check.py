@@ -0,0 +1,124 @@
+"""Multi-process check of the daily announcement leases
+
+Starts several processes which all try to announce the same guilds, like
+bot processes with overlapping shards. One of them dies after claiming its
+guilds, before announcing all of them. A restarted process then picks up
+the unfinished claims the way the cog does on startup. Every guild has to
+be announced exactly once.
+
+Usage::
+
+    python -m Birthday.lease_check --processes 4 --guilds 500
+"""
+
+from pathlib import Path
+from typing import List
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from .lease import DailyLease
+
+FIRE_TIME = 1700000000.0
+
+
+def announce(deliveries: Path, guild_id: int, owner: str):
+    # O_APPEND writes of one line are atomic, so the processes can share the file
+    fd = os.open(deliveries, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, f"{guild_id} {owner}\n".encode())
+    finally:
+        os.close(fd)
+
+
+async def run_worker(path: Path, deliveries: Path, owner: str, guild_ids: List[int], ttl: float, crash_after: int):
+    lease = DailyLease(path, owner=owner, ttl=ttl)
+    claimed = await lease.claim([(guild_id, FIRE_TIME) for guild_id in guild_ids])
+    for i, (guild_id, fire_time) in enumerate(claimed):
+        if i == crash_after:
+            os._exit(1)
+        announce(deliveries, guild_id, owner)
+        await lease.complete(guild_id, fire_time)
+
+
+def worker(path: Path, deliveries: Path, owner: str, guild_ids: List[int], ttl: float, crash_after: int, seed: int):
+    guild_ids = list(guild_ids)
+    random.Random(seed).shuffle(guild_ids)
+    asyncio.run(run_worker(path, deliveries, owner, guild_ids, ttl, crash_after))
+
+
+async def recover(path: Path, deliveries: Path, owner: str, ttl: float) -> int:
+    """Does what `Tasks.recover_claims` and the scheduler do after a restart"""
+    lease = DailyLease(path, owner=owner, ttl=ttl)
+    unfinished = await lease.unfinished(FIRE_TIME - 86400)
+    if unfinished:
+        await asyncio.sleep(max(0.0, max(expires for _, _, expires in unfinished) - time.time()))
+
+    claimed = await lease.claim((guild_id, fire_time) for guild_id, fire_time, _ in unfinished)
+    for guild_id, fire_time in claimed:
+        announce(deliveries, guild_id, owner)
+        await lease.complete(guild_id, fire_time)
+    return len(claimed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--guilds", type=int, default=500)
+    parser.add_argument("--ttl", type=float, default=1.0, help="lease ttl in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    path = Path(tempfile.mkdtemp(prefix="birthday-leases-"))
+    deliveries = path / "deliveries.txt"
+    guild_ids = list(range(1, args.guilds + 1))
+
+    try:
+        start = time.perf_counter()
+        processes = [
+            multiprocessing.Process(
+                target=worker,
+                args=(path, deliveries, f"worker-{i}", guild_ids, args.ttl, 10 if i == 0 else -1, args.seed + i)
+            )
+            for i in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        crashed = sum(process.exitcode != 0 for process in processes)
+        recovered = asyncio.run(recover(path, deliveries, "restarted", args.ttl))
+        elapsed = time.perf_counter() - start
+
+        counts = {guild_id: 0 for guild_id in guild_ids}
+        owners = {}
+        for line in deliveries.read_text().splitlines():
+            guild_id, owner = line.split()
+            counts[int(guild_id)] += 1
+            owners[owner] = owners.get(owner, 0) + 1
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    missing = [guild_id for guild_id, count in counts.items() if count == 0]
+    duplicated = [guild_id for guild_id, count in counts.items() if count > 1]
+
+    print(f"Processes: {args.processes} ({crashed} crashed), guilds: {args.guilds}, took {elapsed:.2f}s")
+    print(f"Recovered after restart: {recovered}")
+    for owner, count in sorted(owners.items()):
+        print(f"  {owner:<12}{count}")
+    print(f"Missing: {len(missing)}, announced twice: {len(duplicated)}")
+
+    if missing or duplicated:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
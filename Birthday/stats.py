@@ -0,0 +1,59 @@
+from collections import deque
+from typing import Deque, List, NamedTuple, Sequence
+
+import math
+
+
+class GuildRun(NamedTuple):
+    guild_id: int
+    scheduled: float
+    started: float
+    finished: float
+    birthdays: int
+    api_calls: int
+
+    @property
+    def lateness(self) -> float:
+        return self.started - self.scheduled
+
+    @property
+    def duration(self) -> float:
+        return self.finished - self.started
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile, 0 for no values"""
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[rank - 1]
+
+
+class SchedulerStats:
+    """Bounded ring buffer of the latest per-guild announcement runs"""
+
+    def __init__(self, size: int = 2000):
+        self.runs: Deque[GuildRun] = deque(maxlen=size)
+
+    def record(self, guild_id: int, scheduled: float, started: float, finished: float, birthdays: int, api_calls: int):
+        self.runs.append(GuildRun(guild_id, scheduled, started, finished, birthdays, api_calls))
+
+    def slowest(self, count: int = 5) -> List[GuildRun]:
+        """Runs which finished the latest after their scheduled time"""
+        return sorted(self.runs, key=lambda run: run.finished - run.scheduled, reverse=True)[:count]
+
+    def summary(self) -> dict:
+        lateness = [run.lateness for run in self.runs]
+        durations = [run.duration for run in self.runs]
+
+        return {
+            "runs": len(self.runs),
+            "birthdays": sum(run.birthdays for run in self.runs),
+            "api_calls": sum(run.api_calls for run in self.runs),
+            "lateness_p50": percentile(lateness, 50),
+            "lateness_p99": percentile(lateness, 99),
+            "duration_p50": percentile(durations, 50),
+            "duration_p99": percentile(durations, 99),
+        }
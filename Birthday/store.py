@@ -0,0 +1,114 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import datetime
+
+# day of year is counted in a leap year, so 29-02 keeps its own slot
+LEAP_YEAR = 2000
+
+# stored birthdays are `year * YEAR_FACTOR + day of year`, see encode_bday
+YEAR_FACTOR = 512
+SCHEMA_VERSION = 1
+
+
+def day_of_year(day: int, month: int) -> int:
+    return datetime.date(LEAP_YEAR, month, day).timetuple().tm_yday
+
+
+def date_from_day(day: int) -> Tuple[int, int]:
+    """`(day, month)` of a day of year"""
+    date = datetime.date(LEAP_YEAR, 1, 1) + datetime.timedelta(days=day - 1)
+    return date.day, date.month
+
+
+def parse_bday(bday: str) -> Tuple[int, int]:
+    """Parses `DD-MM-YYYY` or `DD-MM` into `(day of year, year)`
+
+    `year` is 0 if none is set."""
+    parts = bday.split("-")
+    year = int(parts[2]) if len(parts) == 3 else 0
+    return day_of_year(int(parts[0]), int(parts[1])), year
+
+
+def encode_bday(day: int, year: int) -> int:
+    """Packs a day of year and year (0 if unknown) into the stored integer"""
+    return year * YEAR_FACTOR + day
+
+
+def decode_bday(bday: Union[int, str]) -> Tuple[int, int]:
+    """`(day of year, year)` of a stored birthday
+
+    Also accepts the `DD-MM-YYYY`/`DD-MM` strings of the old schema."""
+    if isinstance(bday, str):
+        return parse_bday(bday)
+    return bday % YEAR_FACTOR, bday // YEAR_FACTOR
+
+
+def format_bday(bday: Union[int, str]) -> str:
+    """`DD-MM-YYYY` or `DD-MM` of a stored birthday"""
+    day, year = decode_bday(bday)
+    day, month = date_from_day(day)
+    return f"{day:02d}-{month:02d}-{year}" if year else f"{day:02d}-{month:02d}"
+
+
+class BirthdayEntry(NamedTuple):
+    user_id: int
+    day: int
+    month: int
+    year: Optional[int]
+
+
+class BirthdayStore:
+    """Birthdays packed into parallel arrays, sorted by day of year
+
+    Takes 12 bytes per birthday instead of a tuple of strings. Sorting,
+    today-matching and range lookups are bisections on `days`."""
+
+    __slots__ = ("user_ids", "days", "years")
+
+    def __init__(self, items: Iterable[Tuple[int, int, int]] = ()):
+        """`items` are `(user id, day of year, year)` tuples, `year` 0 if unknown"""
+        items = sorted(items, key=lambda item: item[1])
+
+        self.user_ids = array("Q", (item[0] for item in items))
+        self.days = array("H", (item[1] for item in items))
+        self.years = array("H", (item[2] for item in items))
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def __bool__(self) -> bool:
+        return len(self.days) > 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (self.user_ids, self.days, self.years))
+
+    def entry(self, i: int) -> BirthdayEntry:
+        day, month = date_from_day(self.days[i])
+        return BirthdayEntry(self.user_ids[i], day, month, self.years[i] or None)
+
+    def age(self, i: int, current_year: int) -> Optional[int]:
+        year = self.years[i]
+        return current_year - year if year else None
+
+    def between(self, first_day: int, last_day: int) -> range:
+        """Indices of all birthdays from `first_day` to `last_day`, both included"""
+        return range(bisect_left(self.days, first_day), bisect_right(self.days, last_day))
+
+    def on_day(self, day: int) -> range:
+        return self.between(day, day)
+
+    def ordered(self, today: int, upcoming_first: bool, current_year: int) -> List[Tuple[int, Optional[int]]]:
+        """`(index, age on the next birthday)` for all birthdays
+
+        Starts with today's birthdays if `upcoming_first` is set,
+        otherwise with the beginning of the year."""
+        split = bisect_left(self.days, today)
+        passed = [(i, self.age(i, current_year + 1)) for i in range(split)]
+        upcoming = [(i, self.age(i, current_year)) for i in range(split, len(self))]
+
+        if upcoming_first:
+            return upcoming + passed
+        return passed + upcoming
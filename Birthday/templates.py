@@ -0,0 +1,85 @@
+from functools import lru_cache
+from string import Formatter
+from typing import Optional, Tuple
+
+import re
+
+ALLOWED_TAGS = ("name", "full_name", "mention", "age", "guild", "date")
+
+DEFAULT_MESSAGE = "{mention} is getting {age} years old today! :partying_face:"
+DEFAULT_MESSAGE_NO_AGE = "It's {mention}'s birthday today! :partying_face:"
+
+_LARGE_NUMBER = re.compile(r"\d{4,}")
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class CompiledTemplate:
+    """A birthday message parsed into literal text and tags
+
+    Only the tags in `ALLOWED_TAGS` are accepted, attribute or index
+    access (`{name.__class__}`) is rejected while compiling."""
+
+    __slots__ = ("source", "parts", "fields")
+
+    def __init__(self, source: str):
+        self.source = source
+        parts = []
+        fields = set()
+
+        try:
+            parsed = list(Formatter().parse(source))
+        except ValueError as e:
+            raise TemplateError(str(e)) from None
+
+        for literal, field, spec, conversion in parsed:
+            if field is None:
+                parts.append((literal, None, None, None))
+                continue
+            if field not in ALLOWED_TAGS:
+                raise TemplateError(f"Unknown tag `{{{field}}}`" if field else "Empty tag `{}`")
+            if conversion not in (None, "s", "r"):
+                raise TemplateError(f"Invalid conversion `!{conversion}` for tag `{{{field}}}`")
+            if spec and any(f is not None for _, f, _, _ in Formatter().parse(spec)):
+                raise TemplateError(f"Nested tags are not allowed in `{{{field}}}`")
+            if spec and _LARGE_NUMBER.search(spec):
+                raise TemplateError(f"Format spec of `{{{field}}}` is too large")
+
+            fields.add(field)
+            parts.append((literal, field, spec, conversion))
+
+        self.parts: Tuple[tuple, ...] = tuple(parts)
+        self.fields = frozenset(fields)
+
+    def render(self, tags: dict) -> str:
+        out = []
+        for literal, field, spec, conversion in self.parts:
+            out.append(literal)
+            if field is None:
+                continue
+
+            value = tags[field]
+            if conversion == "r":
+                value = repr(value)
+            elif conversion == "s":
+                value = str(value)
+            out.append(format(value, spec) if spec else str(value))
+
+        return "".join(out)
+
+
+@lru_cache(maxsize=4096)
+def compile_template(source: str) -> CompiledTemplate:
+    return CompiledTemplate(source)
+
+
+def template_for(source: Optional[str], age) -> CompiledTemplate:
+    """Returns the template to use, falling back to the default messages"""
+    if source:
+        template = compile_template(source)
+        if age is not None or "age" not in template.fields:
+            return template
+
+    return compile_template(DEFAULT_MESSAGE if age is not None else DEFAULT_MESSAGE_NO_AGE)
@@ -0,0 +1,166 @@
+from redbot.core import Config
+
+from typing import Dict, Tuple
+
+import asyncio
+import logging
+import time
+
+log = logging.getLogger("red.benno1237.birthdays.write_queue")
+
+
+class WriteBehindQueue:
+    """Coalesces user and member config writes per key
+
+    Clears and sets are buffered in memory and written in batches,
+    one config write per scope, either every `interval` seconds or as
+    soon as `max_size` keys are pending. A later write to the same key
+    replaces or extends the pending one instead of queueing another write."""
+
+    def __init__(self, config: Config, interval: float = 5.0, max_size: int = 500):
+        self.config = config
+        self.interval = interval
+        self.max_size = max_size
+
+        # (scope, primary keys) -> [cleared, values to set]
+        self._pending: Dict[Tuple[str, Tuple[str, ...]], list] = {}
+        self._lock = asyncio.Lock()
+        self._full = asyncio.Event()
+        self._closing = False
+
+        self.queued = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.flushed_keys = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        """Held while flushing
+
+        Bulk writers of whole scopes (migration, import) hold it as well. All
+        other user and member writes go through the queue."""
+        return self._lock
+
+    def _queue(self, scope: str, keys: Tuple[str, ...], clear: bool, values: dict):
+        key = (scope, tuple(str(k) for k in keys))
+        self.queued += 1
+
+        entry = self._pending.get(key)
+        if entry is None:
+            self._pending[key] = [clear, dict(values)]
+        else:
+            self.coalesced += 1
+            if clear:
+                entry[0], entry[1] = True, dict(values)
+            else:
+                entry[1].update(values)
+
+        if len(self._pending) >= self.max_size:
+            self._full.set()
+
+    def clear_user(self, user_id: int):
+        self._queue(Config.USER, (user_id,), True, {})
+
+    def clear_member(self, guild_id: int, user_id: int):
+        self._queue(Config.MEMBER, (guild_id, user_id), True, {})
+
+    def set_user(self, user_id: int, **values):
+        self._queue(Config.USER, (user_id,), False, values)
+
+    def set_member(self, guild_id: int, user_id: int, **values):
+        self._queue(Config.MEMBER, (guild_id, user_id), False, values)
+
+    def _requeue(self, scope: str, entries: list):
+        # keep writes queued in the meantime, they are newer
+        for keys, (cleared, values) in entries:
+            entry = self._pending.get((scope, keys))
+            if entry is None:
+                self._pending[(scope, keys)] = [cleared, values]
+            elif not entry[0]:
+                entry[0], entry[1] = cleared, {**values, **entry[1]}
+
+    async def flush(self):
+        """Writes all pending keys, one config write per scope"""
+        async with self._lock:
+            if not self._pending:
+                return
+
+            pending, self._pending = self._pending, {}
+            self._full.clear()
+            start = time.perf_counter()
+
+            scopes: Dict[str, list] = {}
+            for (scope, keys), entry in pending.items():
+                scopes.setdefault(scope, []).append((keys, entry))
+
+            scopes = list(scopes.items())
+            for i, (scope, entries) in enumerate(scopes):
+                try:
+                    async with self.config._get_base_group(scope).all() as data:
+                        for keys, (cleared, values) in entries:
+                            *parents, leaf = keys
+                            parent = data
+                            for key in parents:
+                                parent = parent.setdefault(key, {})
+
+                            if cleared:
+                                parent.pop(leaf, None)
+                            if values:
+                                parent.setdefault(leaf, {}).update(values)
+
+                            if parents and not parent:
+                                del data[parents[0]]
+                except BaseException:
+                    # also on cancellation, nothing taken out of the queue may get lost
+                    for scope, entries in scopes[i:]:
+                        self._requeue(scope, entries)
+                    raise
+
+            latency = time.perf_counter() - start
+            self.flushes += 1
+            self.flushed_keys += len(pending)
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            self.total_flush_latency += latency
+
+    async def run(self):
+        """Flushes every `interval` seconds or whenever the queue is full, until `close` is called"""
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._closing:
+                break
+
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Unable to flush queued birthday config writes")
+
+    async def close(self):
+        """Stops `run` and writes everything still queued
+
+        Waits for a flush which is already running instead of interrupting it."""
+        self._closing = True
+        self._full.set()
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "queued": self.queued,
+            "coalesced": self.coalesced,
+            "flushes": self.flushes,
+            "flushed_keys": self.flushed_keys,
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+            "avg_flush_latency": self.total_flush_latency / self.flushes if self.flushes else 0.0,
+        }
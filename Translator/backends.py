@@ -0,0 +1,205 @@
+from collections import Counter, deque
+from typing import Any, Awaitable, Callable, Deque, List, NamedTuple, Optional, Tuple
+
+import aiohttp
+import asyncio
+import json
+import time
+from urllib.parse import urlencode
+
+from .metrics import Histogram, percentile
+from .scheduler import FairScheduler
+from .session import PooledSession
+
+# (translated text, detected source language, confidence in percent or None)
+Translation = Tuple[str, str, Optional[float]]
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36",
+    "accept-language": "en-IN,en-GB;q=0.9,en-US",
+}
+
+
+class TranslationError(Exception):
+    """The translation API failed or answered with something unexpected"""
+
+
+class Backend:
+    """One translation API
+
+    Keeps the latency of its last `samples` successful requests, a
+    histogram of all latencies and counts of the answers' statuses."""
+
+    name = None
+    base_url = None
+    path = None
+
+    def __init__(self, http: PooledSession, base_url: str = None, samples: int = 200):
+        self.http = http
+        if base_url is not None:
+            self.base_url = base_url
+        self.latencies: Deque[float] = deque(maxlen=samples)
+        self.histogram = Histogram()
+        # HTTP status, "invalid" for unreadable answers or "unreachable"
+        self.statuses = Counter()
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+
+    def params(self, texts: List[str], dest_lang: str, src_lang: str) -> list:
+        raise NotImplementedError
+
+    def parse(self, data, count: int, src_lang: str) -> List[Translation]:
+        """Reads the answer for `count` texts, raises `ValueError`, `KeyError`, `IndexError` or `TypeError` if it can't"""
+        raise NotImplementedError
+
+    async def request(self, texts: List[str], dest_lang: str, src_lang: str) -> List[Translation]:
+        self.requests += 1
+        params = self.params(texts, dest_lang, src_lang)
+        self.bytes_sent += len(self.base_url) + len(self.path) + 1 + len(urlencode(params))
+        start = time.perf_counter()
+        session = await self.http.get()
+        try:
+            async with session.get(self.base_url + self.path, params=params, headers=HEADERS) as resp:
+                self.statuses[str(resp.status)] += 1
+                if resp.status != 200:
+                    raise TranslationError("{} answered with status {}".format(self.name, resp.status))
+                results = self.parse(json.loads(await resp.text()), len(texts), src_lang)
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            self._failed(start, "invalid")
+            raise TranslationError("{} sent an unexpected answer".format(self.name)) from e
+        except TranslationError:
+            self._failed(start)
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self._failed(start, "unreachable")
+            raise TranslationError("{} could not be reached: {}".format(self.name, e)) from e
+
+        latency = time.perf_counter() - start
+        self.latencies.append(latency)
+        self.histogram.observe(latency)
+        return results
+
+    def _failed(self, start: float, status: str = None):
+        self.errors += 1
+        self.histogram.observe(time.perf_counter() - start)
+        if status is not None:
+            self.statuses[status] += 1
+
+    async def translate(self, text: str, dest_lang: str, src_lang: str = "auto") -> Translation:
+        results = await self.request([text], dest_lang, src_lang)
+        return results[0]
+
+    async def translate_many(self, texts: List[str], dest_lang: str, src_lang: str = "auto") -> Optional[List[Translation]]:
+        """Translates all texts in one request, `None` if the backend can't"""
+        return None
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self.latencies) < 20:
+            return None
+        return percentile(self.latencies, q * 100)
+
+
+class DictBackend(Backend):
+    """The endpoint of Google's dictionary browser extension"""
+
+    name = "dict"
+    base_url = "https://clients5.google.com"
+    path = "/translate_a/t"
+
+    def params(self, texts, dest_lang, src_lang):
+        return [("client", "dict-chrome-ex"), ("sl", src_lang), ("tl", dest_lang)] + [("q", text) for text in texts]
+
+    def parse(self, data, count, src_lang):
+        if count == 1 and isinstance(data, dict):
+            # the last sentence may only hold a transliteration
+            trans = "".join(sentence["trans"] for sentence in data["sentences"] if "trans" in sentence)
+            return [(trans, data["src"], data["confidence"] * 100)]
+
+        # several texts give `[translation, source language]` pairs, or only translations if the source language was given
+        if not isinstance(data, list) or len(data) != count:
+            raise ValueError("expected {} results".format(count))
+
+        results = []
+        for item in data:
+            if isinstance(item, str) and src_lang != "auto":
+                results.append((item, src_lang, None))
+            elif isinstance(item, list) and len(item) == 2 and all(isinstance(part, str) for part in item):
+                results.append((item[0], item[1], None))
+            else:
+                raise ValueError("unknown result {!r}".format(item))
+        return results
+
+    async def translate_many(self, texts, dest_lang, src_lang="auto"):
+        try:
+            return await self.request(texts, dest_lang, src_lang)
+        except TranslationError:
+            return None
+
+
+class GtxBackend(Backend):
+    """The endpoint of Google's website translator"""
+
+    name = "gtx"
+    base_url = "https://translate.googleapis.com"
+    path = "/translate_a/single"
+
+    def params(self, texts, dest_lang, src_lang):
+        return [("client", "gtx"), ("dt", "t"), ("sl", src_lang), ("tl", dest_lang), ("q", texts[0])]
+
+    def parse(self, data, count, src_lang):
+        trans = "".join(segment[0] for segment in data[0] if segment[0])
+        return [(trans, data[2], None)]
+
+
+BACKENDS = {backend.name: backend for backend in (DictBackend, GtxBackend)}
+
+
+class HedgeResult(NamedTuple):
+    result: Any
+    # whether the second call was started, and whether its result was used
+    hedged: bool
+    hedge_won: bool
+
+
+async def hedged(
+    primary: Callable[[], Awaitable],
+    secondary: Optional[Callable[[], Awaitable]],
+    delay: float,
+    scheduler: FairScheduler = None,
+) -> HedgeResult:
+    """Awaits `primary`, starting `secondary` as well if it takes longer than `delay` seconds or fails
+
+    Returns whichever result arrives first and cancels the other call.
+    Running both at once needs a free slot of `scheduler`, without one
+    `secondary` is only started if `primary` fails."""
+    first = asyncio.ensure_future(primary())
+    if secondary is None:
+        return HedgeResult(await first, False, False)
+
+    pending = {first}
+    slot = False
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done and scheduler is not None:
+            slot = scheduler.try_acquire()
+            if not slot:
+                done, _ = await asyncio.wait(pending)
+        if done and first.exception() is None:
+            return HedgeResult(first.result(), False, False)
+
+        second = asyncio.ensure_future(secondary())
+        pending = {second} if done else {first, second}
+        error = first.exception() if done else None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return HedgeResult(task.result(), True, task is second)
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+        if slot:
+            scheduler.release()
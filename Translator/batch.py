@@ -0,0 +1,86 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+import asyncio
+
+
+class _Batch:
+    __slots__ = ("texts", "futures", "timer")
+
+    def __init__(self):
+        self.texts: List[str] = []
+        self.futures: List[asyncio.Future] = []
+        self.timer = None
+
+
+class Batcher:
+    """Collects texts for the same languages into one upstream request
+
+    A batch is sent `window` seconds after its first text arrived or as
+    soon as it holds `size` texts, so no text waits longer than `window`."""
+
+    def __init__(self, translate_many: Callable[[List[str], Hashable], Awaitable[List[Any]]], window: float = 0.2, size: int = 10):
+        """`translate_many(texts, key)` returns one result per text, in order
+
+        A result may be an exception, it is raised for that text only."""
+        self.translate_many = translate_many
+        self.window = window
+        self.size = size
+        self._pending: Dict[Hashable, _Batch] = {}
+
+        self.batches = 0
+        self.batched_texts = 0
+
+    async def submit(self, text: str, key: Hashable) -> Any:
+        loop = asyncio.get_running_loop()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _Batch()
+            batch.timer = loop.call_later(self.window, self._flush, key)
+
+        future = loop.create_future()
+        batch.texts.append(text)
+        batch.futures.append(future)
+        if len(batch.texts) >= self.size:
+            self._flush(key)
+
+        return await future
+
+    def _flush(self, key: Hashable):
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        asyncio.ensure_future(self._run(batch, key))
+
+    async def _run(self, batch: _Batch, key: Hashable):
+        self.batches += 1
+        self.batched_texts += len(batch.texts)
+        try:
+            results = await self.translate_many(batch.texts, key)
+        except Exception as e:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future, result in zip(batch.futures, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def close(self):
+        """Cancels all batches which weren't sent yet"""
+        for batch in self._pending.values():
+            batch.timer.cancel()
+            for future in batch.futures:
+                future.cancel()
+        self._pending.clear()
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "batched_texts": self.batched_texts,
+            "avg_batch_size": self.batched_texts / self.batches if self.batches else 0.0,
+        }
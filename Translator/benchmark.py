@@ -0,0 +1,322 @@
+"""Offline benchmark of Translator under message and reaction floods
+
+Runs the real listeners (`on_message_without_command`, `on_reaction_add`)
+against the local stub server, an in-memory Config stand-in and fake
+channels, so no network access or Discord connection is needed.
+
+Usage::
+
+    python -m Translator.benchmark --messages 5000 --reactions 2000 --channels 200 --latency 0.1 --jitter 0.03
+"""
+
+from redbot.core import Config
+
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+from unittest import mock
+
+import argparse
+import asyncio
+import copy
+import logging
+import random
+import shutil
+import tempfile
+import time
+
+from . import translator as translator_module
+from .langid import load_samples
+from .metrics import percentile
+from .stubserver import StubServer
+from .translator import Translator
+
+LANGUAGES = ["de", "en", "es", "fr", "it", "nl", "pl", "pt"]
+FLAGS = {"🇩🇪": "de", "🇬🇧": "en", "🇪🇸": "es", "🇫🇷": "fr", "🇮🇹": "it", "🇳🇱": "nl", "🇵🇱": "pl", "🇵🇹": "pt"}
+
+
+class Settings:
+    """The values of one config scope, e.g. `config.guild(guild)`"""
+
+    def __init__(self, config: "MemoryConfig", label: str, defaults: dict, values: dict):
+        self.config = config
+        self.label = label
+        self.defaults = defaults
+        self.values = values
+
+    def __getattr__(self, name: str) -> "Setting":
+        return Setting(self, name)
+
+    async def all(self) -> dict:
+        self.config.calls[self.label + ".all"] += 1
+        return copy.deepcopy({**self.defaults, **self.values})
+
+
+class Setting:
+    def __init__(self, settings: Settings, name: str):
+        self.settings = settings
+        self.name = name
+
+    async def __call__(self):
+        self.settings.config.calls["{}.{}".format(self.settings.label, self.name)] += 1
+        return copy.deepcopy(self.settings.values.get(self.name, self.settings.defaults.get(self.name)))
+
+    async def set(self, value):
+        self.settings.config.calls["{}.{}.set".format(self.settings.label, self.name)] += 1
+        self.settings.values[self.name] = value
+
+
+class MemoryConfig:
+    """Keeps the Translator settings in dicts keyed by id and counts every access in `calls`
+
+    Only covers what the listeners and `initialize` use."""
+
+    def __init__(self):
+        self.globals: dict = {}
+        self.guilds: Dict[int, dict] = {}
+        self.channels: Dict[int, dict] = {}
+        self.defaults: Dict[str, dict] = {"global": {}, "guild": {}, "channel": {}}
+        self.calls: Counter = Counter()
+
+    def register_global(self, **defaults):
+        self.defaults["global"] = defaults
+
+    def register_guild(self, **defaults):
+        self.defaults["guild"] = defaults
+
+    def register_channel(self, **defaults):
+        self.defaults["channel"] = defaults
+
+    def __getattr__(self, name: str) -> Setting:
+        return Setting(Settings(self, "global", self.defaults["global"], self.globals), name)
+
+    def guild(self, guild) -> Settings:
+        return Settings(self, "guild", self.defaults["guild"], self.guilds.setdefault(guild.id, {}))
+
+    def channel(self, channel) -> Settings:
+        return Settings(self, "channel", self.defaults["channel"], self.channels.setdefault(channel.id, {}))
+
+    async def all_guilds(self) -> Dict[int, dict]:
+        self.calls["all_guilds"] += 1
+        return {guild_id: {**self.defaults["guild"], **values} for guild_id, values in self.guilds.items()}
+
+    async def all_channels(self) -> Dict[int, dict]:
+        self.calls["all_channels"] += 1
+        return {channel_id: {**self.defaults["channel"], **values} for channel_id, values in self.channels.items()}
+
+
+class FakeAuthor:
+    name = "benchmark"
+
+
+class FakeMessage:
+    def __init__(self, content: str, channel: "FakeChannel"):
+        self.content = content
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = FakeAuthor()
+        self.created = time.perf_counter()
+
+
+class FakeReaction:
+    def __init__(self, emoji: str, message: FakeMessage):
+        self.emoji = emoji
+        self.message = message
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, guild: "FakeGuild", stats: "FloodStats"):
+        self.id = channel_id
+        self.guild = guild
+        self.stats = stats
+
+    async def send(self, content=None, embed=None):
+        self.stats.sent += 1
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = "guild{}".format(guild_id)
+        self.channels: List[FakeChannel] = []
+
+
+class FakeBot:
+    def __init__(self, guilds: List[FakeGuild]):
+        self._guilds = {guild.id: guild for guild in guilds}
+        self._channels = {channel.id: channel for guild in guilds for channel in guild.channels}
+        self.loop = asyncio.get_running_loop()
+
+    async def get_valid_prefixes(self, guild=None):
+        return ["!"]
+
+    def get_guild(self, guild_id: int) -> Optional[FakeGuild]:
+        return self._guilds.get(guild_id)
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self._channels.get(channel_id)
+
+
+class FloodStats:
+    def __init__(self):
+        self.sent = 0
+        self.latencies: List[float] = []
+        self.failed = 0
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a task which sleeps `interval` seconds"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags: List[float] = []
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - start - self.interval))
+
+
+def populate(config: MemoryConfig, stats: FloodStats, guild_count: int, channel_count: int, seed: int) -> List[FakeGuild]:
+    rng = random.Random(seed)
+    guilds = [FakeGuild((i + 1) << 22) for i in range(guild_count)]
+
+    for i in range(channel_count):
+        guild = guilds[i % guild_count]
+        channel = FakeChannel(guild.id + i + 1, guild, stats)
+        guild.channels.append(channel)
+        config.channels[channel.id] = {"autotrans_status": True, "autotrans_dest_lang": rng.choice(LANGUAGES)}
+
+    for guild in guilds:
+        config.guilds[guild.id] = {"status": True, "use_global_reactions": True, "reactions": {}}
+    config.globals["reactions"] = dict(FLAGS)
+
+    return guilds
+
+
+async def _handle(coro, message: FakeMessage, stats: FloodStats):
+    sent = stats.sent
+    try:
+        await coro
+    except Exception:
+        stats.failed += 1
+        return
+    if stats.sent > sent:
+        stats.latencies.append(time.perf_counter() - message.created)
+
+
+async def flood(cog: Translator, guilds: List[FakeGuild], stats: FloodStats, texts: List[str], messages: int, reactions: int,
+                rate: float, unique: float, seed: int):
+    rng = random.Random(seed)
+    channels = [channel for guild in guilds for channel in guild.channels]
+    events = ["message"] * messages + ["reaction"] * reactions
+    rng.shuffle(events)
+
+    tasks = []
+    start = time.perf_counter()
+    for i, event in enumerate(events):
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        text = rng.choice(texts)
+        if rng.random() < unique:
+            text = "{} ({})".format(text, i)
+        message = FakeMessage(text, rng.choice(channels))
+
+        if event == "message":
+            coro = cog.on_message_without_command(message)
+        else:
+            coro = cog.on_reaction_add(FakeReaction(rng.choice(list(FLAGS)), message), None)
+        tasks.append(asyncio.ensure_future(_handle(coro, message, stats)))
+
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - start
+
+
+async def run(args):
+    server = StubServer(args.latency, args.jitter, args.error_rate)
+    await server.start()
+
+    config = MemoryConfig()
+    stats = FloodStats()
+    data_path = Path(tempfile.mkdtemp(prefix="translator-benchmark-"))
+    with mock.patch.object(Config, "get_conf", return_value=config), \
+            mock.patch.object(translator_module, "cog_data_path", return_value=data_path):
+        guilds = populate(config, stats, args.guilds, args.channels, args.seed)
+        config.globals.update({"concurrency": args.concurrency, "batch_window": args.batch_window, "batch_size": args.batch_size})
+        if args.skip:
+            config.globals["skip_same_language"] = True
+
+        cog = Translator(FakeBot(guilds))
+        for backend in cog.backends.values():
+            backend.base_url = server.url
+        await cog.init_task
+
+    monitor = LoopLagMonitor()
+    monitor_task = asyncio.ensure_future(monitor.run())
+    config.calls.clear()
+
+    texts = [text for _, text in load_samples(Path(__file__).parent / "data" / "langid" / "samples.tsv")]
+    cpu_start = time.process_time()
+    wall = await flood(cog, guilds, stats, texts, args.messages, args.reactions, args.rate, args.unique, args.seed)
+    cpu = time.process_time() - cpu_start
+
+    monitor_task.cancel()
+    cog.cog_unload()
+    await cog.http.close()
+    await server.stop()
+    shutil.rmtree(data_path, ignore_errors=True)
+
+    events = args.messages + args.reactions
+    cache = cog.cache.stats()
+    latencies = stats.latencies
+
+    print("Guilds: {}, channels: {}, messages: {}, reactions: {}".format(args.guilds, args.channels, args.messages, args.reactions))
+    print("Stub: latency {}s, jitter {}s, error rate {}".format(args.latency, args.jitter, args.error_rate))
+    print("Wall time:          {:.2f}s ({:.0f} events/s)".format(wall, events / wall if wall else 0))
+    print("CPU time:           {:.2f}s".format(cpu))
+    print("Translations sent:  {} ({:.0f}/s), skipped as same language: {}, unanswered: {} (listener errors: {})".format(
+        stats.sent, stats.sent / wall if wall else 0, cog.langid.skipped, events - stats.sent - cog.langid.skipped, stats.failed))
+    print("End-to-end latency: p50 {:.0f}ms, p99 {:.0f}ms, max {:.0f}ms".format(
+        percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, max(latencies, default=0) * 1000))
+    print("Event loop lag:     p50 {:.1f}ms, p99 {:.1f}ms, max {:.1f}ms".format(
+        percentile(monitor.lags, 50) * 1000, percentile(monitor.lags, 99) * 1000, max(monitor.lags, default=0) * 1000))
+    print("Upstream calls:     {} requests for {} segments".format(server.requests, server.segments))
+    print("  per backend:      {}".format(", ".join("{} {}".format(name, backend.requests) for name, backend in cog.backends.items())))
+    print("  cache hit rate:   {:.1f}%, joined running requests: {}, batches: {} ({} messages), hedged: {}".format(
+        cache["hit_rate"] * 100, cog.inflight.coalesced, cog.batcher.batches, cog.batcher.batched_texts, cog.hedges))
+    print("Config calls:")
+    for name, count in config.calls.most_common():
+        print("  {:<28}{}".format(name, count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--channels", type=int, default=100, help="autotranslate channels, spread over the guilds")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--reactions", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=0, help="events per second, 0 sends all at once")
+    parser.add_argument("--unique", type=float, default=0.5, help="share of messages with unique text")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="standard deviation of the stub latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of stub requests answered with 503")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-window", type=float, default=0.2)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--skip", action="store_true", help="skip messages already in the destination language")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # failed translations are expected with --error-rate
+    logging.getLogger("red.benno1237.translator").setLevel(logging.ERROR)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+
+# (normalized text, source language, destination language)
+CacheKey = Tuple[str, str, str]
+# (translated text, detected source language, confidence)
+CacheValue = Tuple[str, str, float]
+
+_ENTRY_OVERHEAD = 200
+
+log = logging.getLogger("red.benno1237.translator.cache")
+
+
+def make_key(text: str, src_lang: str, dest_lang: str) -> CacheKey:
+    """Collapses whitespace within lines, so copy-pasted variants share one entry"""
+    return "\n".join(" ".join(line.split()) for line in text.strip().splitlines()), src_lang, dest_lang
+
+
+class DiskCache:
+    """SQLite tier of the translation cache, keeps it warm across restarts
+
+    All queries run in the default executor. A failing lookup counts as a
+    miss and a failing write is skipped, e.g. while the database is locked."""
+
+    def __init__(self, path: Path, max_entries: int = 100000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "text TEXT, src TEXT, dest TEXT, trans TEXT, detected TEXT, conf REAL, expires REAL, "
+            "PRIMARY KEY (text, src, dest))"
+        )
+        self._db.commit()
+
+    def _get(self, key: CacheKey, now: float) -> Optional[CacheValue]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT trans, detected, conf FROM translations WHERE text = ? AND src = ? AND dest = ? AND expires > ?",
+                (*key, now)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def _put(self, key: CacheKey, value: CacheValue, expires: float):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?, ?)", (*key, *value, expires))
+            self._db.commit()
+
+    def _prune(self, now: float):
+        with self._lock:
+            self._db.execute("DELETE FROM translations WHERE expires <= ?", (now,))
+            self._db.execute(
+                "DELETE FROM translations WHERE rowid NOT IN "
+                "(SELECT rowid FROM translations ORDER BY expires DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self._db.commit()
+
+    def _clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM translations")
+            self._db.commit()
+
+    async def get(self, key: CacheKey) -> Optional[CacheValue]:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, self._get, key, time.time())
+        except sqlite3.Error as e:
+            log.warning("Disk cache lookup failed: %s", e)
+            return None
+
+    async def put(self, key: CacheKey, value: CacheValue, expires: float):
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._put, key, value, expires)
+        except sqlite3.Error as e:
+            log.warning("Disk cache write failed: %s", e)
+
+    async def prune(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._prune, time.time())
+
+    async def clear(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._clear)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class TranslationCache:
+    """Memory bounded LRU cache with TTL in front of the translation API
+
+    Holds at most `max_entries` translations and roughly `max_bytes` of
+    text. Entries expire after `ttl` seconds. An optional `DiskCache`
+    serves memory misses and receives every new translation."""
+
+    def __init__(self, max_entries: int = 5000, max_bytes: int = 4 * 1024 * 1024, ttl: float = 86400):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk: Optional[DiskCache] = None
+
+        # key -> (value, expires, size)
+        self._entries: "OrderedDict[CacheKey, Tuple[CacheValue, float, int]]" = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._bytes
+
+    def _remove(self, key: CacheKey):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _store(self, key: CacheKey, value: CacheValue, expires: float):
+        if key in self._entries:
+            self._remove(key)
+
+        size = len(key[0].encode()) + len(value[0].encode()) + _ENTRY_OVERHEAD
+        self._entries[key] = (value, expires, size)
+        self._bytes += size
+
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def get_memory(self, key: CacheKey) -> Optional[CacheValue]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        value, expires, _ = entry
+        if expires <= time.time():
+            self._remove(key)
+            self.expirations += 1
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    async def get(self, key: CacheKey) -> Optional[CacheValue]:
+        value = self.get_memory(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self.disk is not None:
+            value = await self.disk.get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self._store(key, value, time.time() + self.ttl)
+                return value
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: CacheKey, value: CacheValue):
+        expires = time.time() + self.ttl
+        self._store(key, value, expires)
+        if self.disk is not None:
+            await self.disk.put(key, value, expires)
+
+    async def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+        if self.disk is not None:
+            await self.disk.clear()
+
+    async def enable_disk(self, path: Path) -> bool:
+        """Opens the disk tier, False if the database can't be used"""
+        if self.disk is None:
+            disk = None
+            try:
+                disk = DiskCache(path)
+                await disk.prune()
+            except sqlite3.Error as e:
+                log.error("Unable to open the disk cache %s: %s", path, e)
+                if disk is not None:
+                    disk.close()
+                return False
+            self.disk = disk
+        return True
+
+    def disable_disk(self):
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
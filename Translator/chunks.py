@@ -0,0 +1,63 @@
+from typing import List, Tuple
+from urllib.parse import quote
+
+import re
+
+# the APIs are queried with GET, which fails for URLs longer than about 2K characters
+MAX_QUERY_LENGTH = 1800
+
+# paragraphs, then sentences, then words
+_BOUNDARIES = [re.compile(r"(\n\s*\n)"), re.compile(r"(?<=[.!?…。！？])(\s+)"), re.compile(r"(\s+)")]
+
+
+def encoded_length(text: str) -> int:
+    return len(quote(text, safe=""))
+
+
+def _pieces(text: str, limit: int, level: int = 0) -> List[Tuple[str, str]]:
+    """`(piece, separator after it)` pairs, split as coarse as possible so every piece fits"""
+    if encoded_length(text) <= limit:
+        return [(text, "")]
+
+    if level == len(_BOUNDARIES):
+        pieces = []
+        while text:
+            end = len(text)
+            while encoded_length(text[:end]) > limit:
+                end = max(1, end * limit // encoded_length(text[:end]) - 1)
+            pieces.append((text[:end], ""))
+            text = text[end:]
+        return pieces
+
+    parts = _BOUNDARIES[level].split(text)
+    pieces = []
+    leading = ""
+    for part, separator in zip(parts[::2], parts[1::2] + [""]):
+        if part:
+            sub_pieces = _pieces(leading + part, limit, level + 1)
+            leading = ""
+            last, last_separator = sub_pieces[-1]
+            pieces += sub_pieces[:-1] + [(last, last_separator + separator)]
+        elif pieces:
+            last, last_separator = pieces[-1]
+            pieces[-1] = (last, last_separator + separator)
+        else:
+            leading += separator
+    return pieces
+
+
+def split_text(text: str, limit: int = MAX_QUERY_LENGTH) -> List[Tuple[str, str]]:
+    """Splits `text` on paragraph, sentence or word boundaries into chunks which encode to at most `limit` characters
+
+    Returns `(chunk, separator)` pairs, joining every chunk followed by
+    its separator gives back `text`."""
+    chunks = []
+    for piece, separator in _pieces(text, limit):
+        if chunks:
+            chunk, previous_separator = chunks[-1]
+            merged = chunk + previous_separator + piece
+            if encoded_length(merged) <= limit:
+                chunks[-1] = (merged, separator)
+                continue
+        chunks.append((piece, separator))
+    return chunks
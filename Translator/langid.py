@@ -0,0 +1,134 @@
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import math
+import re
+
+_WORD = re.compile(r"[^\W\d_]+")
+_NOISE = re.compile(r"https?://\S+|<[^>]*>|:\w+:")
+
+
+def ngrams(text: str, n_max: int = 3) -> Counter:
+    """Character 1- to `n_max`-grams of all words, padded with spaces"""
+    grams = Counter()
+    for word in _WORD.findall(_NOISE.sub(" ", text).lower()):
+        word = " {} ".format(word)
+        for n in range(1, n_max + 1):
+            for i in range(len(word) - n + 1):
+                grams[word[i:i + n]] += 1
+    return grams
+
+
+def load_samples(path: Path) -> List[Tuple[str, str]]:
+    """`(language, text)` pairs of a tab separated sample file"""
+    samples = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if "\t" in line:
+                lang, text = line.rstrip("\n").split("\t", 1)
+                samples.append((lang, text))
+    return samples
+
+
+class LanguageIdentifier:
+    """Offline language detection with a character n-gram model
+
+    A naive Bayes classifier trained on one text per language. It only
+    answers for texts of at least `min_letters` letters, shorter ones
+    give `(None, 0.0)`. `sharpness` scales how fast the confidence grows
+    with the score difference between the best languages."""
+
+    def __init__(self, texts: Dict[str, str], min_letters: int = 15, smoothing: float = 0.5, sharpness: float = 10.0):
+        self.min_letters = min_letters
+        self.smoothing = smoothing
+        self.sharpness = sharpness
+
+        profiles = {lang: ngrams(text) for lang, text in texts.items()}
+        vocabulary = set()
+        for grams in profiles.values():
+            vocabulary.update(grams)
+
+        self.languages = sorted(profiles)
+        # gram -> log probability per language, grams missing in a language use its fallback
+        self._log_probs: Dict[str, Dict[str, float]] = {}
+        self._fallback: Dict[str, float] = {}
+        for lang, grams in profiles.items():
+            total = sum(grams.values()) + smoothing * len(vocabulary)
+            self._fallback[lang] = math.log(smoothing / total)
+            for gram, count in grams.items():
+                self._log_probs.setdefault(gram, {})[lang] = math.log((count + smoothing) / total)
+
+        self.detected = 0
+        self.skipped = 0
+
+    @classmethod
+    def from_directory(cls, path: Path, **kwargs) -> "LanguageIdentifier":
+        """Trains on every `<language>.txt` in `path`"""
+        texts = {file.stem: file.read_text(encoding="utf-8") for file in Path(path).glob("*.txt")}
+        return cls(texts, **kwargs)
+
+    def detect(self, text: str) -> Tuple[Optional[str], float]:
+        """`(language, confidence)` of `text`, confidence between 0 and 1"""
+        grams = ngrams(text)
+        if sum(count for gram, count in grams.items() if len(gram) == 1 and gram != " ") < self.min_letters:
+            return None, 0.0
+
+        scores = {lang: 0.0 for lang in self.languages}
+        for gram, count in grams.items():
+            log_probs = self._log_probs.get(gram)
+            if log_probs is None:
+                continue
+            for lang in self.languages:
+                scores[lang] += count * log_probs.get(lang, self._fallback[lang])
+
+        # compares the average per gram, otherwise long texts are always certain
+        size = sum(grams.values())
+        best = max(scores.values())
+        weights = {lang: math.exp((score - best) * self.sharpness / size) for lang, score in scores.items()}
+        lang = max(weights, key=weights.get)
+        return lang, weights[lang] / sum(weights.values())
+
+    def is_language(self, text: str, lang: str, threshold: float) -> bool:
+        """Whether `text` is in `lang` with at least `threshold` confidence"""
+        self.detected += 1
+        detected, confidence = self.detect(text)
+        if detected == lang and confidence >= threshold:
+            self.skipped += 1
+            return True
+        return False
+
+    def evaluate(self, samples: Iterable[Tuple[str, str]], threshold: float) -> dict:
+        """How translations to each known language would have been skipped
+
+        The skip rate is the share of samples skipped when translating to
+        their own language. The false skip rate is the share skipped when
+        translating to another language, these would be wrongly untranslated.
+        Samples in languages the model doesn't know count separately, the
+        unknown skip rate is the share of them skipped for any destination."""
+        samples = list(samples)
+        skips = same = false_skips = other = 0
+        unknown = unknown_skips = 0
+        for lang, text in samples:
+            detected, confidence = self.detect(text)
+            confident = confidence >= threshold
+            if lang not in self.languages:
+                unknown += 1
+                unknown_skips += confident and detected is not None
+                continue
+
+            for dest_lang in self.languages:
+                if dest_lang == lang:
+                    same += 1
+                    skips += confident and detected == dest_lang
+                else:
+                    other += 1
+                    false_skips += confident and detected == dest_lang
+
+        return {
+            "samples": len(samples) - unknown,
+            "unknown_samples": unknown,
+            "skip_rate": skips / same if same else 0.0,
+            "false_skip_rate": false_skips / other if other else 0.0,
+            "unknown_skip_rate": unknown_skips / unknown if unknown else 0.0,
+        }
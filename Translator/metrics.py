@@ -0,0 +1,118 @@
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import math
+import os
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile, 0 for no values"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[rank - 1]
+
+
+class Histogram:
+    """Counts observations per bucket, the last bucket is everything above the highest bound"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the `q` quantile, `inf` if it is above all bounds"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """Translation volume per guild and channel"""
+
+    def __init__(self):
+        self.translations = 0
+        self.characters = 0
+        self.guild_translations = Counter()
+        self.guild_characters = Counter()
+        self.channel_translations = Counter()
+        self.channel_characters = Counter()
+
+    def record(self, guild_id: int, channel_id: int, characters: int):
+        self.translations += 1
+        self.characters += characters
+        self.guild_translations[guild_id] += 1
+        self.guild_characters[guild_id] += characters
+        self.channel_translations[channel_id] += 1
+        self.channel_characters[channel_id] += characters
+
+
+def _labels(labels: Dict[str, object]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class PrometheusText:
+    """Collects samples and renders them in the Prometheus text format"""
+
+    def __init__(self, prefix: str = "red_translator_"):
+        self.prefix = prefix
+        # name -> (type, help, samples)
+        self._metrics: "OrderedDict[str, Tuple[str, str, List[str]]]" = OrderedDict()
+
+    def _family(self, name: str, kind: str, help: str) -> List[str]:
+        name = self.prefix + name
+        if name not in self._metrics:
+            self._metrics[name] = (kind, help, [])
+        return self._metrics[name][2]
+
+    def add(self, name: str, kind: str, help: str, value: float, **labels):
+        self._family(name, kind, help).append("{}{}{} {}".format(self.prefix, name, _labels(labels), value))
+
+    def add_histogram(self, name: str, help: str, histogram: Histogram, **labels):
+        samples = self._family(name, "histogram", help)
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else bound
+            samples.append("{}{}_bucket{} {}".format(self.prefix, name, _labels(dict(labels, le=le)), cumulative))
+        samples.append("{}{}_sum{} {}".format(self.prefix, name, _labels(labels), histogram.sum))
+        samples.append("{}{}_count{} {}".format(self.prefix, name, _labels(labels), histogram.count))
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help, samples) in self._metrics.items():
+            lines.append("# HELP {} {}".format(name, help))
+            lines.append("# TYPE {} {}".format(name, kind))
+            lines += samples
+        return "\n".join(lines) + "\n"
+
+
+def write_atomic(path: Path, text: str):
+    """Replaces `path`, so readers never see a half written file"""
+    temp = path.with_suffix(path.suffix + ".tmp")
+    temp.write_text(text, encoding="utf-8")
+    os.replace(temp, path)
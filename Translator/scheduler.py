@@ -0,0 +1,142 @@
+from collections import Counter, OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List
+
+import asyncio
+
+COMMAND = 0
+REACTION = 1
+AUTOTRANS = 2
+
+PRIORITY_NAMES = {COMMAND: "command", REACTION: "reaction", AUTOTRANS: "autotrans"}
+
+
+class _WaitStats:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, wait: float):
+        self.count += 1
+        self.total += wait
+        self.max = max(self.max, wait)
+
+
+class FairScheduler:
+    """Limits how many upstream requests run at once
+
+    Waiting requests are started by priority (commands, then reactions,
+    then autotranslate). Within one priority the guilds take turns, so a
+    single busy guild can't starve the others."""
+
+    def __init__(self, limit: int = 8):
+        self._limit = limit
+        self.active = 0
+        # priority -> guild id -> waiting futures, guilds in round robin order
+        self._queues: List["OrderedDict[int, Deque[asyncio.Future]]"] = [OrderedDict() for _ in PRIORITY_NAMES]
+
+        self.waits: Dict[int, _WaitStats] = {priority: _WaitStats() for priority in PRIORITY_NAMES}
+        self.usage = Counter()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @limit.setter
+    def limit(self, limit: int):
+        """Raising the limit starts waiting requests right away"""
+        self._limit = limit
+        self._fill()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiters) for queue in self._queues for waiters in queue.values())
+
+    async def run(self, guild_id: int, priority: int, func: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await self._acquire(guild_id, priority)
+        self.waits[priority].add(loop.time() - start)
+        self.usage[guild_id] += 1
+        try:
+            return await func()
+        finally:
+            self.release()
+
+    async def _acquire(self, guild_id: int, priority: int):
+        if self.active < self.limit and not self.queued:
+            self.active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues[priority]
+        queue.setdefault(guild_id, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the slot was handed over just before the cancellation
+                self.release()
+            else:
+                waiters = queue.get(guild_id)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del queue[guild_id]
+            raise
+
+    def try_acquire(self) -> bool:
+        """Takes a free slot without waiting, it has to be given back with `release`"""
+        if self.active < self.limit and not self.queued:
+            self.active += 1
+            return True
+        return False
+
+    def release(self):
+        self.active -= 1
+        self._fill()
+
+    def _fill(self):
+        while self.active < self.limit:
+            future = self._next()
+            if future is None:
+                return
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+    def _next(self):
+        for queue in self._queues:
+            if queue:
+                guild_id, waiters = next(iter(queue.items()))
+                future = waiters.popleft()
+                del queue[guild_id]
+                if waiters:
+                    queue[guild_id] = waiters
+                return future
+        return None
+
+    def close(self):
+        """Cancels all requests waiting for a slot"""
+        for queue in self._queues:
+            for waiters in queue.values():
+                for future in waiters:
+                    future.cancel()
+            queue.clear()
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "waits": {
+                PRIORITY_NAMES[priority]: {
+                    "count": wait.count,
+                    "avg": wait.total / wait.count if wait.count else 0.0,
+                    "max": wait.max,
+                }
+                for priority, wait in self.waits.items()
+            },
+            "top_guilds": self.usage.most_common(5),
+        }
@@ -0,0 +1,129 @@
+from types import SimpleNamespace
+from typing import Awaitable, Callable, Dict, Optional
+
+import aiohttp
+import asyncio
+import time
+
+DEFAULT_HTTP_SETTINGS = {
+    "limit": 100,
+    "limit_per_host": 20,
+    "keepalive_timeout": 30,
+    "dns_cache_ttl": 300,
+    "timeout": 10,
+}
+
+
+class PooledSession:
+    """One `aiohttp.ClientSession` shared by all translations
+
+    Keeps connections alive between requests and counts how many
+    requests reused a connection, together with their latency."""
+
+    def __init__(self, loader: Callable[[], Awaitable[dict]] = None):
+        """`loader` returns the stored settings, it is awaited before the first request"""
+        self.settings = dict(DEFAULT_HTTP_SETTINGS)
+        self._loader = loader
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = asyncio.Lock()
+        # replaced sessions waiting for their last requests, see configure
+        self._retiring: Dict[asyncio.Task, aiohttp.ClientSession] = {}
+        self._closed = False
+
+        self.connections_created = 0
+        self.reused_requests = 0
+        self.reused_latency = 0.0
+        self.new_requests = 0
+        self.new_latency = 0.0
+
+    async def get(self) -> aiohttp.ClientSession:
+        """The current session, raises `RuntimeError` once the pool was closed"""
+        if self._closed:
+            raise RuntimeError("the session pool is closed")
+        if self._session is None or self._session.closed:
+            async with self._lock:
+                if self._session is None or self._session.closed:
+                    if self._loader is not None:
+                        self.settings.update(await self._loader())
+                        self._loader = None
+                    self._session = self._create()
+
+        return self._session
+
+    def _create(self) -> aiohttp.ClientSession:
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(self._on_request_start)
+        trace.on_connection_create_end.append(self._on_connection_create_end)
+        trace.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        trace.on_request_end.append(self._on_request_end)
+
+        connector = aiohttp.TCPConnector(
+            limit=self.settings["limit"],
+            limit_per_host=self.settings["limit_per_host"],
+            keepalive_timeout=self.settings["keepalive_timeout"],
+            ttl_dns_cache=self.settings["dns_cache_ttl"],
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.settings["timeout"]),
+            trace_configs=[trace],
+        )
+
+    async def configure(self, **settings):
+        """Applies new settings by swapping in a new pool
+
+        The old pool is closed once requests started on it had `timeout`
+        seconds to finish, so they aren't cut off."""
+        async with self._lock:
+            grace = self.settings["timeout"]
+            self.settings.update(settings)
+            old = self._session
+            if old is None or old.closed:
+                return
+            self._session = self._create()
+
+        task = asyncio.ensure_future(self._retire(old, grace))
+        self._retiring[task] = old
+        task.add_done_callback(self._retiring.pop)
+
+    async def _retire(self, session: aiohttp.ClientSession, grace: float):
+        await asyncio.sleep(grace)
+        await session.close()
+
+    async def close(self):
+        self._closed = True
+        for task, session in list(self._retiring.items()):
+            task.cancel()
+            await session.close()
+
+        session, self._session = self._session, None
+        if session is not None and not session.closed:
+            await session.close()
+
+    async def _on_request_start(self, session, ctx: SimpleNamespace, params):
+        ctx.start = time.perf_counter()
+        ctx.reused = False
+
+    async def _on_connection_create_end(self, session, ctx: SimpleNamespace, params):
+        self.connections_created += 1
+
+    async def _on_connection_reuseconn(self, session, ctx: SimpleNamespace, params):
+        ctx.reused = True
+
+    async def _on_request_end(self, session, ctx: SimpleNamespace, params):
+        latency = time.perf_counter() - ctx.start
+        if ctx.reused:
+            self.reused_requests += 1
+            self.reused_latency += latency
+        else:
+            self.new_requests += 1
+            self.new_latency += latency
+
+    def stats(self) -> dict:
+        return {
+            "connections_created": self.connections_created,
+            "reused_requests": self.reused_requests,
+            "new_requests": self.new_requests,
+            "avg_reused_latency": self.reused_latency / self.reused_requests if self.reused_requests else 0.0,
+            "avg_new_latency": self.new_latency / self.new_requests if self.new_requests else 0.0,
+        }
@@ -0,0 +1,38 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+import asyncio
+
+
+class SingleFlight:
+    """Runs one call per key at a time, concurrent callers share its result
+
+    The shared call runs as its own task, so one cancelled caller doesn't
+    cancel it for the others."""
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._tasks
+
+    def close(self):
+        """Cancels all running calls"""
+        for task in self._tasks.values():
+            task.cancel()
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(task)
@@ -0,0 +1,109 @@
+"""Local stand-in for the translation APIs
+
+Answers both backend endpoints without network access, with optional
+latency, jitter and errors. Translations are the text reversed and
+prefixed with the destination language, the source language is always
+"en".
+
+Point a backend's `base_url` at it.
+
+Usage::
+
+    python -m Translator.stubserver --port 8080 --latency 0.2 --error-rate 0.05
+"""
+
+from typing import Optional
+
+import argparse
+import asyncio
+import random
+
+from aiohttp import web
+
+
+class StubServer:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, error_rate: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.segments = 0
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_get("/translate_a/t", self.handle_dict)
+        self.app.router.add_get("/translate_a/single", self.handle_gtx)
+
+    @property
+    def url(self) -> str:
+        return "http://{}:{}".format(self.host, self.port)
+
+    @staticmethod
+    def translate(text: str, dest_lang: str) -> str:
+        return "[{}] {}".format(dest_lang, text[::-1])
+
+    async def _delay(self):
+        self.requests += 1
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        if random.random() < self.error_rate:
+            raise web.HTTPServiceUnavailable()
+
+    async def handle_dict(self, request: web.Request) -> web.Response:
+        await self._delay()
+        texts = request.query.getall("q", [])
+        dest_lang = request.query.get("tl", "en")
+        self.segments += len(texts)
+
+        if len(texts) == 1:
+            return web.json_response({
+                "sentences": [{"trans": self.translate(texts[0], dest_lang), "orig": texts[0]}],
+                "src": "en",
+                "confidence": 1.0,
+            })
+        return web.json_response([[self.translate(text, dest_lang), "en"] for text in texts])
+
+    async def handle_gtx(self, request: web.Request) -> web.Response:
+        await self._delay()
+        text = request.query.get("q", "")
+        self.segments += 1
+        return web.json_response([[[self.translate(text, request.query.get("tl", "en")), text, None, None]], None, "en"])
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def _serve(args):
+    server = StubServer(args.latency, args.jitter, args.error_rate, port=args.port)
+    await server.start()
+    print("Serving on {}".format(server.url))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="standard deviation of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
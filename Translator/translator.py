@@ -1,9 +1,24 @@
 from redbot.core import commands, Config, checks
-import json
-import aiohttp
+from redbot.core.data_manager import bundled_data_path, cog_data_path
+from redbot.core.utils.chat_formatting import pagify
+import asyncio
 import discord
+import logging
+from collections import Counter
 from typing import Union, Optional
 
+from .backends import BACKENDS, TranslationError, hedged
+from .batch import Batcher
+from .cache import TranslationCache, make_key
+from .chunks import MAX_QUERY_LENGTH, encoded_length, split_text
+from .langid import LanguageIdentifier, load_samples
+from .metrics import Metrics, PrometheusText, write_atomic
+from .scheduler import AUTOTRANS, COMMAND, REACTION, FairScheduler
+from .session import DEFAULT_HTTP_SETTINGS, PooledSession
+from .singleflight import SingleFlight
+
+log = logging.getLogger("red.benno1237.translator")
+
 supported_languages = {'af': 'afrikaans', 'sq': 'albanian', 'am': 'amharic', 'ar': 'arabic', 'hy': 'armenian', 'az': 'azerbaijani', 'eu': 'basque', 'be': 'belarusian', 'bn': 'bengali', 'bs': 'bosnian', 'bg': 'bulgarian', 'ca': 'catalan', 'ceb': 'cebuano', 'ny': 'chichewa', 'zh-cn': 'chinese (simplified)', 'zh-tw': 'chinese (traditional)', 'co': 'corsican', 'hr': 'croatian', 'cs': 'czech', 'da': 'danish', 'nl': 'dutch', 'en': 'english', 'eo': 'esperanto', 'et': 'estonian', 'tl': 'filipino', 'fi': 'finnish', 'fr': 'french', 'fy': 'frisian', 'gl': 'galician', 'ka': 'georgian', 'de': 'german', 'el': 'greek', 'gu': 'gujarati', 'ht': 'haitian creole', 'ha': 'hausa', 'haw': 'hawaiian', 'iw': 'hebrew', 'he': 'hebrew', 'hi': 'hindi', 'hmn': 'hmong', 'hu': 'hungarian', 'is': 'icelandic', 'ig': 'igbo', 'id': 'indonesian', 'ga': 'irish', 'it': 'italian', 'ja': 'japanese', 'jw': 'javanese', 'kn': 'kannada', 'kk': 'kazakh', 'km': 'khmer', 'ko': 'korean', 'ku': 'kurdish (kurmanji)', 'ky': 'kyrgyz', 'lo': 'lao', 'la': 'latin', 'lv': 'latvian', 'lt': 'lithuanian', 'lb': 'luxembourgish', 'mk': 'macedonian', 'mg': 'malagasy', 'ms': 'malay', 'ml': 'malayalam', 'mt': 'maltese', 'mi': 'maori', 'mr': 'marathi', 'mn': 'mongolian', 'my': 'myanmar (burmese)', 'ne': 'nepali', 'no': 'norwegian', 'or': 'odia', 'ps': 'pashto', 'fa': 'persian', 'pl': 'polish', 'pt': 'portuguese', 'pa': 'punjabi', 'ro': 'romanian', 'ru': 'russian', 'sm': 'samoan', 'gd': 'scots gaelic', 'sr': 'serbian', 'st': 'sesotho', 'sn': 'shona', 'sd': 'sindhi', 'si': 'sinhala', 'sk': 'slovak', 'sl': 'slovenian', 'so': 'somali', 'es': 'spanish', 'su': 'sundanese', 'sw': 'swahili', 'sv': 'swedish', 'tg': 'tajik', 'ta': 'tamil', 'te': 'telugu', 'th': 'thai', 'tr': 'turkish', 'uk': 'ukrainian', 'ur': 'urdu', 'ug': 'uyghur', 'uz': 'uzbek', 'vi': 'vietnamese', 'cy': 'welsh', 'xh': 'xhosa', 'yi': 'yiddish', 'yo': 'yoruba', 'zu': 'zulu'}
 
 class Translator(commands.Cog):
@@ -11,10 +26,21 @@ class Translator(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.config = Config.get_conf(self, identifier=42069)
-        self.request_url = "https://clients5.google.com/translate_a/t?client=dict-chrome-ex&sl={}&tl={}&q={}"
 
         default_global = {
-            "reactions": {}
+            "reactions": {},
+            "http": DEFAULT_HTTP_SETTINGS,
+            "disk_cache": False,
+            "batch_window": 0.2,
+            "batch_size": 10,
+            "skip_same_language": False,
+            "skip_threshold": 0.8,
+            "concurrency": 8,
+            "backend": "dict",
+            "hedge_backend": "gtx",
+            "hedge_delay": None,
+            "metrics_file": False,
+            "metrics_interval": 60
         }
 
         default_guild = {
@@ -32,25 +58,251 @@ class Translator(commands.Cog):
         self.config.register_guild(**default_guild)
         self.config.register_channel(**default_channel)
 
-    async def translate_message(self, message, dest_lang, src_lang = "auto"):
-        """Translating the messages.
-        Using an open google translate API link."""
-        
-        options = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36",
-            "accept-language": "en-IN,en-GB;q=0.9,en-US",
+        self.http = PooledSession(loader=self.config.http)
+        self.backends = {name: backend(self.http) for name, backend in BACKENDS.items()}
+        self.backend = self.backends["dict"]
+        self.hedge_backend = self.backends["gtx"]
+        self.hedge_delay = None
+        self.hedges = 0
+        self.hedges_won = 0
+        self.metrics = Metrics()
+        self.metrics_path = cog_data_path(self) / "metrics.prom"
+        self.metrics_task = None
+        self.cache = TranslationCache()
+        self.inflight = SingleFlight()
+        self.batcher = Batcher(self.translate_batch)
+        self.scheduler = FairScheduler()
+        # channel id -> destination language of all channels with autotranslate on
+        self.autotrans_channels = {}
+        # guild id -> emoji -> destination language of all guilds with reactions on
+        self.reaction_maps = {}
+        self.cache_path = cog_data_path(self) / "translations.sqlite3"
+        self.langid = LanguageIdentifier.from_directory(bundled_data_path(self) / "langid")
+        self.skip_threshold = None
+        self.init_task = self.bot.loop.create_task(self.initialize())
+        self.init_task.add_done_callback(self.initialize_done)
+
+    def initialize_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Unable to load the Translator settings", exc_info=task.exception())
+
+    async def initialize(self):
+        self.batcher.window = await self.config.batch_window()
+        self.batcher.size = await self.config.batch_size()
+        self.scheduler.limit = await self.config.concurrency()
+        self.backend = self.backends[await self.config.backend()]
+        self.hedge_backend = self.backends.get(await self.config.hedge_backend())
+        self.hedge_delay = await self.config.hedge_delay()
+        if await self.config.skip_same_language():
+            self.skip_threshold = await self.config.skip_threshold()
+
+        for channel_id, data in (await self.config.all_channels()).items():
+            if data["autotrans_status"] and data["autotrans_dest_lang"] is not None:
+                self.autotrans_channels[channel_id] = data["autotrans_dest_lang"]
+
+        await self.update_reaction_maps()
+
+        if await self.config.disk_cache():
+            await self.cache.enable_disk(self.cache_path)
+
+        if await self.config.metrics_file():
+            self.start_metrics_file()
+
+    def start_metrics_file(self):
+        if self.metrics_task is None:
+            self.metrics_task = self.bot.loop.create_task(self.metrics_file_loop())
+
+    def stop_metrics_file(self):
+        if self.metrics_task is not None:
+            self.metrics_task.cancel()
+            self.metrics_task = None
+
+    async def metrics_file_loop(self):
+        """Writing all metrics to a Prometheus text file, e.g. for node_exporter's textfile collector."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, write_atomic, self.metrics_path, self.collect_metrics().render())
+            except OSError:
+                log.exception("Writing the metrics file failed")
+            await asyncio.sleep(await self.config.metrics_interval())
+
+    def collect_metrics(self):
+        metrics = PrometheusText()
+
+        for backend in self.backends.values():
+            metrics.add_histogram("upstream_latency_seconds", "Latency of upstream translation requests", backend.histogram, backend=backend.name)
+        for backend in self.backends.values():
+            for status, count in backend.statuses.items():
+                metrics.add("upstream_responses_total", "counter", "Upstream answers by HTTP status, invalid or unreachable", count, backend=backend.name, status=status)
+        for backend in self.backends.values():
+            metrics.add("upstream_bytes_sent_total", "counter", "Bytes of upstream request URLs", backend.bytes_sent, backend=backend.name)
+        metrics.add("hedged_requests_total", "counter", "Requests which were sent to the hedge backend as well", self.hedges)
+        metrics.add("hedge_wins_total", "counter", "Hedged requests answered by the hedge backend first", self.hedges_won)
+
+        metrics.add("translations_total", "counter", "Requested translations", self.metrics.translations)
+        metrics.add("translated_characters_total", "counter", "Characters of requested translations", self.metrics.characters)
+        # only the busiest guilds and channels, to keep the number of series bounded
+        for guild_id, count in self.metrics.guild_translations.most_common(50):
+            metrics.add("guild_translations_total", "counter", "Requested translations of the busiest guilds", count, guild=guild_id)
+        for guild_id, count in self.metrics.guild_characters.most_common(50):
+            metrics.add("guild_characters_total", "counter", "Characters of the busiest guilds", count, guild=guild_id)
+        for channel_id, count in self.metrics.channel_translations.most_common(50):
+            metrics.add("channel_translations_total", "counter", "Requested translations of the busiest channels", count, channel=channel_id)
+        for channel_id, count in self.metrics.channel_characters.most_common(50):
+            metrics.add("channel_characters_total", "counter", "Characters of the busiest channels", count, channel=channel_id)
+
+        cache = self.cache.stats()
+        for result in ("hits", "disk_hits", "misses"):
+            metrics.add("cache_lookups_total", "counter", "Translation cache lookups by result", cache[result], result=result)
+        metrics.add("cache_evictions_total", "counter", "Entries evicted from the translation cache", cache["evictions"])
+        metrics.add("cache_entries", "gauge", "Entries in the translation cache", cache["entries"])
+        metrics.add("cache_bytes", "gauge", "Approximate size of the translation cache", cache["bytes"])
+        metrics.add("coalesced_requests_total", "counter", "Requests which joined a running identical request", self.inflight.coalesced)
+        metrics.add("batches_total", "counter", "Batched upstream requests", self.batcher.batches)
+        metrics.add("batched_messages_total", "counter", "Messages sent in batches", self.batcher.batched_texts)
+        metrics.add("langid_checked_total", "counter", "Autotranslated messages checked for their language", self.langid.detected)
+        metrics.add("langid_skipped_total", "counter", "Autotranslated messages skipped as already in the destination language", self.langid.skipped)
+
+        scheduler = self.scheduler.stats()
+        metrics.add("scheduler_active", "gauge", "Running upstream requests", scheduler["active"])
+        metrics.add("scheduler_queued", "gauge", "Upstream requests waiting for a slot", scheduler["queued"])
+        for priority, wait in scheduler["waits"].items():
+            metrics.add("scheduler_wait_seconds_max", "gauge", "Longest wait for a slot", wait["max"], priority=priority)
+
+        return metrics
+
+    @staticmethod
+    def merge_reactions(data, global_reactions):
+        """Guild reactions take precedence over global ones."""
+        reactions = dict(global_reactions) if data["use_global_reactions"] else {}
+        reactions.update(data["reactions"])
+        return reactions
+
+    async def update_reaction_maps(self):
+        """Rebuilding the reaction maps of all guilds."""
+        global_reactions = await self.config.reactions()
+        self.reaction_maps = {
+            guild_id: self.merge_reactions(data, global_reactions)
+            for guild_id, data in (await self.config.all_guilds()).items()
+            if data["status"]
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(self.request_url.format(src_lang, dest_lang, message), headers=options) as resp:
-                trans_dict = json.loads(await resp.text())
+    async def update_reaction_map(self, guild):
+        """Rebuilding the reaction map of one guild after its settings changed."""
+        data = await self.config.guild(guild).all()
+        if data["status"]:
+            self.reaction_maps[guild.id] = self.merge_reactions(data, await self.config.reactions())
+        else:
+            self.reaction_maps.pop(guild.id, None)
+
+    async def update_autotrans_channel(self, channel):
+        """Keeping the autotranslate channel map in sync with the config."""
+        status = await self.config.channel(channel).autotrans_status()
+        dest_lang = await self.config.channel(channel).autotrans_dest_lang()
+
+        if status and dest_lang is not None:
+            self.autotrans_channels[channel.id] = dest_lang
+        else:
+            self.autotrans_channels.pop(channel.id, None)
+
+    def cog_unload(self):
+        self.stop_metrics_file()
+        self.init_task.cancel()
+        self.batcher.close()
+        self.scheduler.close()
+        self.inflight.close()
+        self.bot.loop.create_task(self.http.close())
+        self.cache.disable_disk()
+
+    async def translate_message(self, message, dest_lang, src_lang = "auto", batch = False, guild = None, channel = None, priority = COMMAND):
+        """Translating the messages.
+        Answered from the cache if the same text was translated before,
+        concurrent requests for the same text share one API call
+        unless it is queued at a lower priority.
+        With `batch` the message may wait up to the batch window to be
+        sent together with others. API calls are queued by `priority`
+        and take turns between guilds."""
+        guild_id = guild.id if guild is not None else 0
+        self.metrics.record(guild_id, channel.id if channel is not None else 0, len(message))
+
+        key = make_key(message, src_lang, dest_lang)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        # only join a request queued at the same or a higher priority, a command must not wait behind autotranslate
+        for joined in range(COMMAND, priority):
+            if (key, joined) in self.inflight:
+                priority = joined
+                break
+        return await self.inflight.do((key, priority), lambda: self.translate_uncached(key, batch, guild_id, priority))
 
-        trans_msg = trans_dict["sentences"][0]["trans"]
-        src_lang = trans_dict["src"]
-        conf = trans_dict["confidence"] * 100
+    async def translate_uncached(self, key, batch, guild_id, priority):
+        text, src_lang, dest_lang = key
+        # a full batch of messages has to fit into one request as well
+        if batch and self.batcher.size > 1 and encoded_length(text) <= MAX_QUERY_LENGTH // self.batcher.size:
+            result = await self.batcher.submit(text, (guild_id, src_lang, dest_lang))
+        else:
+            result = await self.fetch_translation(text, dest_lang, src_lang, guild_id, priority)
+        await self.cache.put(key, result)
+        return result
+
+    async def translate_batch(self, messages, key):
+        """Translating several autotranslated messages of one guild in one request.
+        Falls back to one request per message if the answer looks different than expected,
+        a message failing there only fails for itself."""
+        guild_id, src_lang, dest_lang = key
+        if len(messages) > 1:
+            results = await self.scheduler.run(guild_id, AUTOTRANS, lambda: self.fetch_batch(messages, dest_lang, src_lang))
+            if results is not None:
+                return results
+
+        return await asyncio.gather(*(
+            self.fetch_translation(message, dest_lang, src_lang, guild_id, AUTOTRANS) for message in messages
+        ), return_exceptions=True)
+
+    async def fetch_batch(self, messages, dest_lang, src_lang):
+        """Using one request for all messages, `None` if the backend can't."""
+        return await self.backend.translate_many(messages, dest_lang, src_lang)
+
+    async def fetch_translation(self, message, dest_lang, src_lang = "auto", guild_id = 0, priority = COMMAND):
+        """Splitting long messages into chunks which fit into a request.
+        The chunks are translated at the same time, each in its own API slot, and put back together in order."""
+        chunks = split_text(message)
+        if len(chunks) == 1:
+            return await self.scheduler.run(guild_id, priority, lambda: self.fetch_chunk(message, dest_lang, src_lang))
+
+        results = await asyncio.gather(*(
+            self.scheduler.run(guild_id, priority, lambda chunk=chunk: self.fetch_chunk(chunk, dest_lang, src_lang))
+            for chunk, _ in chunks
+        ))
+
+        trans_msg = "".join(result[0] + separator for result, (_, separator) in zip(results, chunks))
+        src_lang = Counter(result[1] for result in results).most_common(1)[0][0]
+        confs = [result[2] for result in results if result[2] is not None]
+        conf = min(confs) if confs else None
 
         return trans_msg, src_lang, conf
 
+    async def fetch_chunk(self, message, dest_lang, src_lang = "auto"):
+        """Asking the hedge backend as well if the backend is slower than usual or fails.
+        The hedge request needs a free API slot of its own, unless the backend failed."""
+        delay = self.hedge_delay
+        if delay is None:
+            delay = self.backend.percentile(0.95) or 1.0
+
+        secondary = None
+        if self.hedge_backend is not None and self.hedge_backend is not self.backend:
+            secondary = lambda: self.hedge_backend.translate(message, dest_lang, src_lang)
+
+        result, hedge, hedge_won = await hedged(
+            lambda: self.backend.translate(message, dest_lang, src_lang), secondary, delay, self.scheduler
+        )
+        self.hedges += hedge
+        self.hedges_won += hedge_won
+        return result
+
     async def create_embed_status_autotrans(self, channel):
         """Creating the "autotrans" status embed.
         Cleaning the main code up."""
@@ -85,11 +337,291 @@ class Translator(commands.Cog):
             color = discord.Color.blue(),
             description = "Translator")
         
-        embed.add_field(name="Translated message to {}:".format(supported_languages[dest_lang]), value=trans_message, inline=False)
-        embed.add_field(name="Translated from:", value=supported_languages[src_lang] + " \n Detected with a confidence of {}%".format(conf), inline=False)
+        # long translations are split over several fields, each holds up to 1024 characters
+        for i, page in enumerate(pagify(trans_message, delims=["\n", " "], page_length=1024, shorten_by=0)):
+            name = "Translated message to {}:".format(supported_languages[dest_lang]) if i == 0 else "\u200b"
+            embed.add_field(name=name, value=page, inline=False)
+        if conf is None:
+            embed.add_field(name="Translated from:", value=supported_languages[src_lang], inline=False)
+        else:
+            embed.add_field(name="Translated from:", value=supported_languages[src_lang] + " \n Detected with a confidence of {}%".format(conf), inline=False)
 
         return embed
 
+    @checks.is_owner()
+    @commands.group()
+    async def translator(self, ctx):
+        """Owner settings of the translator."""
+        pass
+
+    @translator.command(name="stats")
+    async def translator_stats(self, ctx):
+        """Show upstream latency, errors and traffic, the busiest guilds and channels and how often requests were saved."""
+        lines = []
+        for backend in self.backends.values():
+            histogram = backend.histogram
+            quantiles = ("{:g}s".format(q) if q is not None else "-" for q in (histogram.quantile(0.5), histogram.quantile(0.95), histogram.quantile(0.99)))
+            lines.append("{}: {} requests, {:.1f} KiB sent, p50 <= {}, p95 <= {}, p99 <= {}".format(
+                backend.name, backend.requests, backend.bytes_sent / 1024, *quantiles
+            ))
+            if backend.statuses:
+                lines.append("  " + ", ".join("{}: {}".format(status, count) for status, count in sorted(backend.statuses.items())))
+
+        lines.append("")
+        lines.append("Translations: {} ({} characters)".format(self.metrics.translations, self.metrics.characters))
+        lines.append("Busiest guilds: " + (", ".join(
+            "{} ({})".format(self.bot.get_guild(guild_id) or guild_id, count) for guild_id, count in self.metrics.guild_translations.most_common(3)
+        ) or "-"))
+        lines.append("Busiest channels: " + (", ".join(
+            "{} ({})".format(self.bot.get_channel(channel_id) or channel_id, count) for channel_id, count in self.metrics.channel_translations.most_common(3)
+        ) or "-"))
+
+        cache = self.cache.stats()
+        checked = self.langid.detected
+        lines.append("")
+        lines.append("Cache hit rate: {:.1f}%".format(cache["hit_rate"] * 100))
+        lines.append("Joined running requests: {}".format(self.inflight.coalesced))
+        lines.append("Skipped as already translated: {:.1f}% of {}".format(self.langid.skipped / checked * 100 if checked else 0, checked))
+        lines.append("Hedged requests: {} (hedge was faster: {})".format(self.hedges, self.hedges_won))
+        lines.append("Metrics file: {}".format(self.metrics_path if self.metrics_task is not None else "off"))
+
+        for page in pagify("\n".join(lines), page_length=1900):
+            await ctx.send("```\n" + page + "\n```")
+
+    @translator.command(name="metricsfile")
+    async def translator_metricsfile(self, ctx, status: bool, interval: int = None):
+        """Write all metrics to a Prometheus text file in the cog's data folder every `interval` seconds."""
+        if interval is not None:
+            if interval < 5:
+                await ctx.send("The interval has to be at least 5 seconds.")
+                return
+            await self.config.metrics_interval.set(interval)
+
+        await self.config.metrics_file.set(status)
+        if status:
+            self.start_metrics_file()
+            await ctx.send("Writing metrics to {} every {} seconds.".format(self.metrics_path, await self.config.metrics_interval()))
+        else:
+            self.stop_metrics_file()
+            await ctx.send("The metrics file is no longer written.")
+
+    @translator.command(name="http")
+    async def translator_http(self, ctx):
+        """Show the connection pool settings and how often connections were reused."""
+        stats = self.http.stats()
+        settings = "\n".join("{}: {}".format(key, value) for key, value in self.http.settings.items())
+
+        await ctx.send(
+            "```\n"
+            + settings
+            + "\n\nConnections opened: {}\n".format(stats["connections_created"])
+            + "Requests on new connections: {} (avg {:.0f}ms)\n".format(stats["new_requests"], stats["avg_new_latency"] * 1000)
+            + "Requests on reused connections: {} (avg {:.0f}ms)\n".format(stats["reused_requests"], stats["avg_reused_latency"] * 1000)
+            + "```"
+        )
+
+    @translator.command(name="httpset")
+    async def translator_httpset(self, ctx, setting, value: float):
+        """Change a connection pool setting.
+
+        Settings: limit, limit_per_host, keepalive_timeout, dns_cache_ttl, timeout (seconds)"""
+        if setting not in DEFAULT_HTTP_SETTINGS:
+            await ctx.send("Unknown setting. Valid ones are: {}".format(", ".join(DEFAULT_HTTP_SETTINGS)))
+            return
+        if value < 0:
+            await ctx.send("The value can't be negative.")
+            return
+
+        value = value if setting == "timeout" else int(value)
+        async with self.config.http() as http:
+            http[setting] = value
+        await self.http.configure(**{setting: value})
+
+        await ctx.send("{} is now set to {}".format(setting, value))
+
+    @translator.command(name="cache")
+    async def translator_cache(self, ctx):
+        """Show the translation cache usage and hit rate."""
+        stats = self.cache.stats()
+
+        await ctx.send(
+            "```\n"
+            + "Entries: {} / {}\n".format(stats["entries"], self.cache.max_entries)
+            + "Size: {:.1f} / {:.1f} KiB\n".format(stats["bytes"] / 1024, self.cache.max_bytes / 1024)
+            + "Disk cache: {}\n\n".format("on" if self.cache.disk else "off")
+            + "Hits: {} (disk: {})\n".format(stats["hits"], stats["disk_hits"])
+            + "Misses: {}\n".format(stats["misses"])
+            + "Hit rate: {:.1f}%\n".format(stats["hit_rate"] * 100)
+            + "Evictions: {}, expired: {}\n".format(stats["evictions"], stats["expirations"])
+            + "Upstream calls avoided by joining running requests: {}\n".format(self.inflight.coalesced)
+            + "```"
+        )
+
+    @translator.command(name="batch")
+    async def translator_batch(self, ctx, window: float = None, size: int = None):
+        """Show or change how autotranslated messages are batched.
+
+        Messages for the same language are sent together after `window` seconds or once `size` messages are waiting.
+        A size of 1 sends every message on its own."""
+        if window is not None:
+            if window < 0 or window > 5 or (size is not None and size < 1):
+                await ctx.send("The window has to be between 0 and 5 seconds and the size at least 1.")
+                return
+
+            await self.config.batch_window.set(window)
+            self.batcher.window = window
+            if size is not None:
+                await self.config.batch_size.set(size)
+                self.batcher.size = size
+
+        stats = self.batcher.stats()
+        await ctx.send(
+            "```\n"
+            + "Window: {}s\nSize: {}\n\n".format(self.batcher.window, self.batcher.size)
+            + "Batches sent: {}\n".format(stats["batches"])
+            + "Messages batched: {} (avg {:.1f} per batch)\n".format(stats["batched_texts"], stats["avg_batch_size"])
+            + "```"
+        )
+
+    @translator.command(name="cacheclear")
+    async def translator_cacheclear(self, ctx):
+        """Clear all cached translations."""
+        await self.cache.clear()
+        await ctx.send("The translation cache has been cleared.")
+
+    @translator.command(name="diskcache")
+    async def translator_diskcache(self, ctx, status: bool):
+        """Keep cached translations on disk, so they survive restarts."""
+        if status:
+            if not await self.cache.enable_disk(self.cache_path):
+                await ctx.send("The disk cache could not be opened, check the log for details.")
+                return
+        else:
+            self.cache.disable_disk()
+        await self.config.disk_cache.set(status)
+
+        await ctx.send("The disk cache is now {}.".format("on" if status else "off"))
+
+    @translator.command(name="backend")
+    async def translator_backend(self, ctx, backend = None, hedge_backend = None):
+        """Show or change which translation API is used.
+
+        `hedge_backend` is asked as well if `backend` is slow or fails, `none` turns that off.
+        Backends: dict, gtx"""
+        if backend is not None:
+            if backend not in self.backends or (hedge_backend is not None and hedge_backend != "none" and hedge_backend not in self.backends):
+                await ctx.send("Unknown backend. Valid ones are: {}".format(", ".join(self.backends)))
+                return
+
+            await self.config.backend.set(backend)
+            self.backend = self.backends[backend]
+            if hedge_backend is not None:
+                await self.config.hedge_backend.set(hedge_backend)
+                self.hedge_backend = self.backends.get(hedge_backend)
+
+        latencies = "\n".join(
+            "{}: {} requests, {} errors, p50 {}, p95 {}".format(
+                name, backend.requests, backend.errors,
+                *("{:.0f}ms".format(p * 1000) if p is not None else "-" for p in (backend.percentile(0.5), backend.percentile(0.95)))
+            )
+            for name, backend in self.backends.items()
+        )
+
+        await ctx.send(
+            "```\n"
+            + "Backend: {}\n".format(self.backend.name)
+            + "Hedge backend: {}\n".format(self.hedge_backend.name if self.hedge_backend else "none")
+            + "Hedge delay: {}\n".format("{}s".format(self.hedge_delay) if self.hedge_delay is not None else "p95 of the backend")
+            + "Hedged requests: {} (hedge was faster: {})\n\n".format(self.hedges, self.hedges_won)
+            + latencies
+            + "\n```"
+        )
+
+    @translator.command(name="hedgedelay")
+    async def translator_hedgedelay(self, ctx, delay = None):
+        """Set after how many seconds the hedge backend is asked as well.
+
+        Leave it empty to use the backend's 95th latency percentile."""
+        if delay is not None:
+            try:
+                delay = float(delay)
+            except ValueError:
+                await ctx.send("The delay has to be a number of seconds.")
+                return
+            if delay < 0:
+                await ctx.send("The delay can't be negative.")
+                return
+
+        await self.config.hedge_delay.set(delay)
+        self.hedge_delay = delay
+        await ctx.send("The hedge delay is now {}.".format("{}s".format(delay) if delay is not None else "the backend's p95"))
+
+    @translator.command(name="queue")
+    async def translator_queue(self, ctx, limit: int = None):
+        """Show how long translations waited for an API slot and which guilds use the most.
+
+        `limit` changes how many API requests may run at once."""
+        if limit is not None:
+            if limit < 1:
+                await ctx.send("The limit has to be at least 1.")
+                return
+            await self.config.concurrency.set(limit)
+            self.scheduler.limit = limit
+
+        stats = self.scheduler.stats()
+        waits = "\n".join(
+            "{}: {} requests, avg wait {:.0f}ms, max {:.0f}ms".format(name, wait["count"], wait["avg"] * 1000, wait["max"] * 1000)
+            for name, wait in stats["waits"].items()
+        )
+        guilds = "\n".join(
+            "{}: {}".format(self.bot.get_guild(guild_id) or guild_id, count) for guild_id, count in stats["top_guilds"]
+        )
+
+        await ctx.send(
+            "```\n"
+            + "Limit: {}\nRunning: {}\nWaiting: {}\n\n".format(self.scheduler.limit, stats["active"], stats["queued"])
+            + waits
+            + "\n\nMost requests:\n"
+            + (guilds or "None yet")
+            + "\n```"
+        )
+
+    @translator.command(name="langid")
+    async def translator_langid(self, ctx, threshold: float = None):
+        """Show how often autotranslate skipped messages already in the destination language.
+
+        Also checks the offline language detection against the bundled samples, with the current or the given threshold."""
+        threshold = threshold if threshold is not None else await self.config.skip_threshold()
+        result = self.langid.evaluate(load_samples(bundled_data_path(self) / "langid" / "samples.tsv"), threshold)
+
+        await ctx.send(
+            "```\n"
+            + "Skipping: {}\n".format("on, threshold {}".format(self.skip_threshold) if self.skip_threshold is not None else "off")
+            + "Checked messages: {}\nSkipped: {}\n\n".format(self.langid.detected, self.langid.skipped)
+            + "Samples: {} ({}), threshold {}\n".format(result["samples"], ", ".join(self.langid.languages), threshold)
+            + "Skip rate: {:.1f}%\n".format(result["skip_rate"] * 100)
+            + "False skip rate: {:.1f}%\n".format(result["false_skip_rate"] * 100)
+            + "Other languages: {} samples, {:.1f}% skipped\n".format(result["unknown_samples"], result["unknown_skip_rate"] * 100)
+            + "```"
+        )
+
+    @translator.command(name="skipset")
+    async def translator_skipset(self, ctx, status: bool, threshold: float = None):
+        """Skip autotranslating messages which are detected to be in the destination language already.
+
+        `threshold` is the confidence needed, between 0 and 1.
+        Off by default: languages close to a known one, e.g. Luxembourgish and German, may be skipped by mistake."""
+        if threshold is not None:
+            if not 0 < threshold <= 1:
+                await ctx.send("The threshold has to be between 0 and 1.")
+                return
+            await self.config.skip_threshold.set(threshold)
+
+        await self.config.skip_same_language.set(status)
+        self.skip_threshold = await self.config.skip_threshold() if status else None
+
+        await ctx.send("Skipping is now {}.".format("on, threshold {}".format(self.skip_threshold) if status else "off"))
+
     @checks.mod()
     @commands.group()
     async def autotrans(self, ctx):
@@ -114,6 +646,7 @@ class Translator(commands.Cog):
         new = not current
 
         await self.config.channel(channel).autotrans_status.set(new)
+        await self.update_autotrans_channel(channel)
 
         await ctx.send(embed=await self.create_embed_status_autotrans(channel))
     
@@ -127,6 +660,7 @@ class Translator(commands.Cog):
 
         else:
             await self.config.channel(channel).autotrans_dest_lang.set(lang)
+            await self.update_autotrans_channel(channel)
             await ctx.send(embed=await self.create_embed_status_autotrans(channel))
 
     @commands.Cog.listener()
@@ -134,13 +668,22 @@ class Translator(commands.Cog):
         """Wait for message.
         If autotranslate is activated, translate and send an embed"""
         channel = message.channel
-        status = await self.config.channel(channel).autotrans_status()
-        dest_lang = await self.config.channel(channel).autotrans_dest_lang()
+        dest_lang = self.autotrans_channels.get(channel.id)
+        if dest_lang is None:
+            return
+
         prefix, *_ = await self.bot.get_valid_prefixes(message.guild)
 
-        if (status) and (dest_lang != None) and (message.content.startswith(prefix) == False) and (message.author.name != "Arc-Bot"):
-            trans_msg, src_lang, conf = await self.translate_message(message.content, dest_lang)
-            
+        if (message.content.startswith(prefix) == False) and (message.author.name != "Arc-Bot"):
+            if self.skip_threshold is not None and self.langid.is_language(message.content, dest_lang, self.skip_threshold):
+                return
+
+            try:
+                trans_msg, src_lang, conf = await self.translate_message(message.content, dest_lang, batch=True, guild=message.guild, channel=channel, priority=AUTOTRANS)
+            except TranslationError as e:
+                log.warning("Autotranslating a message in %s failed: %s", channel.id, e)
+                return
+
             await channel.send(embed=await self.create_embed_translated(trans_msg, dest_lang, src_lang, conf))
 
     @checks.mod()
@@ -169,6 +712,7 @@ class Translator(commands.Cog):
             if reaction not in current:
                 async with self.config.guild(ctx.guild).reactions() as current: 
                     current[reaction] = dest_lang
+                await self.update_reaction_map(guild)
 
                 await ctx.send("{} is now translating to {}".format(reaction, supported_languages[dest_lang]))
             else:
@@ -188,6 +732,7 @@ class Translator(commands.Cog):
             if reaction not in current:
                 async with self.config.reactions() as current:
                     current[reaction] = dest_lang
+                await self.update_reaction_maps()
 
                 await ctx.send("{} is now translating to {}".format(reaction, supported_languages[dest_lang]))
             else:
@@ -208,6 +753,7 @@ class Translator(commands.Cog):
         if reaction in current:
             current.pop(reaction)
             await self.config.guild(guild).reactions.set(current)
+            await self.update_reaction_map(guild)
 
             await ctx.send("Sucessfully removed: {}".format(reaction))
 
@@ -223,6 +769,7 @@ class Translator(commands.Cog):
         if reaction in current:
             current.pop(reaction)
             await self.config.reactions.set(current)
+            await self.update_reaction_maps()
 
             await ctx.send("Successfully removed: {}".format(reaction))
 
@@ -240,6 +787,7 @@ class Translator(commands.Cog):
         guild = ctx.guild
         global_list_status = not await self.config.guild(guild).use_global_reactions()
         await self.config.guild(guild).use_global_reactions.set(global_list_status)
+        await self.update_reaction_map(guild)
 
         await ctx.send(embed=await self.create_embed_status_reactions(guild))
 
@@ -249,6 +797,7 @@ class Translator(commands.Cog):
         guild = ctx.guild
         status = not await self.config.guild(guild).status()
         await self.config.guild(guild).status.set(status)
+        await self.update_reaction_map(guild)
 
         await ctx.send(embed=await self.create_embed_status_reactions(guild))        
 
@@ -326,31 +875,30 @@ class Translator(commands.Cog):
     @commands.Cog.listener()
     async def on_reaction_add(self, reaction, user):
         message = reaction.message
-        channel = message.channel
-        status = await self.config.guild(message.guild).status()
+        if message.guild is None:
+            return
 
-        if status:
-            valid_guild_reactions = await self.config.guild(message.guild).reactions()
+        reactions = self.reaction_maps.get(message.guild.id)
+        if not reactions:
+            return
 
-            if await self.config.guild(message.guild).use_global_reactions():
-                valid_global_reactions = await self.config.reactions()
-        
-            else:
-                valid_global_reactions = {}
-
-            if ((reaction.emoji in valid_guild_reactions) or (reaction.emoji in valid_global_reactions)):
-                try:
-                    async with self.config.reactions() as valid_global_reactions:
-                        dest_lang = valid_global_reactions[reaction.emoji]
-                except:
-                    async with self.config.guild(message.guild).reactions() as valid_guild_reactions:
-                        dest_lang = valid_guild_reactions[reaction.emoji]
+        dest_lang = reactions.get(str(reaction.emoji))
+        if dest_lang is not None:
+            try:
+                trans_msg, src_lang, conf = await self.translate_message(message.content, dest_lang, guild=message.guild, channel=message.channel, priority=REACTION)
+            except TranslationError as e:
+                log.warning("Translating a reacted message in %s failed: %s", message.channel.id, e)
+                return
 
-                trans_msg, src_lang, conf = await self.translate_message(message.content, dest_lang)
-                await channel.send(embed=await self.create_embed_translated(trans_msg, dest_lang, src_lang, conf))
+            await message.channel.send(embed=await self.create_embed_translated(trans_msg, dest_lang, src_lang, conf))
 
     @commands.command(name="translate")
     async def translate(self, ctx, dest_lang, *, message: str):
         '''translates a given message'''
-        trans_msg, src_lang, conf = await self.translate_message(message, dest_lang)
+        try:
+            trans_msg, src_lang, conf = await self.translate_message(message, dest_lang, guild=ctx.guild, channel=ctx.channel)
+        except TranslationError as e:
+            await ctx.send("The translation failed: {}".format(e))
+            return
+
         await ctx.send(embed=await self.create_embed_translated(trans_msg, dest_lang, src_lang, conf))        